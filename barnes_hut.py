@@ -0,0 +1,278 @@
+"""
+Barnes-Hut gravity on flat arrays
+
+QuadTree sorts the bodies along a Morton (Z order) curve, so every cell of the tree is a
+contiguous range of the sorted bodies and a node is just a row in a few arrays: start, end,
+level, first child, child count, mass and center of mass (prefix sums over the sorted bodies).
+The tree is built one level at a time, only the bodies of cells with more than leaf_size
+bodies are split further.
+
+The forces are evaluated for all bodies at once with a frontier of (body, node) pairs that
+starts at the root: a node that looks small from the body (size / distance < theta, the
+opening angle) acts as one mass at its center of mass, a leaf that does not is summed body by
+body and any other node is replaced by its children. theta = 0 is the exact sum, larger is
+faster and less accurate, 0.5 is the usual trade-off. Bodies are processed in chunks to bound
+the size of the frontier.
+
+BarnesHut plugs mutual gravity into simulation.Simulation.forces. python barnes_hut.py
+compares it against the brute force sum and prints the accuracy and speed-up as JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+
+def part1by1(x):
+    # spreads the bits of x so a zero sits between every two of them
+    x = x.astype(np.uint64)
+    x = (x | (x << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x3333333333333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return x
+
+def morton_codes(cells):
+    # (N, 2) integer cells -> Z order codes
+    return part1by1(cells[:, 0]) | (part1by1(cells[:, 1]) << np.uint64(1))
+
+def ranges(starts, counts):
+    # the indices start, start + 1, ... of every range, concatenated
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(counts.sum()) - first
+
+class QuadTree:
+
+    def __init__(self, positions, masses, leaf_size=8, max_depth=21):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        n = len(positions)
+        masses = np.broadcast_to(np.asarray(masses, dtype=float), (n,))
+        self.leaf_size = leaf_size
+
+        # the root square around all bodies, max_depth bits per axis
+        low = positions.min(axis=0)
+        self.root_size = max(float((positions.max(axis=0) - low).max()), 1e-9) * (1 + 1e-9)
+        resolution = 1 << max_depth
+        cells = np.minimum((positions - low) / self.root_size * resolution, resolution - 1).astype(np.int64)
+        codes = morton_codes(cells)
+        self.order = np.argsort(codes, kind="stable")
+        codes = codes[self.order]
+        self.positions = positions[self.order]
+        self.masses = masses[self.order]
+
+        # nodes level by level, children of one node are consecutive rows
+        starts = [np.array([0])]
+        ends = [np.array([n])]
+        levels = [np.array([0])]
+        parents = [np.array([-1])]
+        first_node = 1
+        split = np.flatnonzero(ends[0] - starts[0] > leaf_size)
+        for level in range(1, max_depth + 1):
+            if not len(split):
+                break
+            parent_starts = starts[-1][split]
+            parent_ends = ends[-1][split]
+            counts = parent_ends - parent_starts
+            body = ranges(parent_starts, counts)
+            prefix = codes[body] >> np.uint64(2*(max_depth - level))
+            # a new cell begins at the first body of a parent and wherever the prefix changes
+            new = np.ones(len(body), dtype=bool)
+            new[1:] = prefix[1:] != prefix[:-1]
+            new[np.cumsum(counts) - counts] = True
+            child_starts = body[new]
+            child_parents = np.repeat(split, counts)[new]
+            last = np.append(child_parents[1:] != child_parents[:-1], True)
+            child_ends = np.where(last, ends[-1][child_parents], np.append(child_starts[1:], 0))
+            # parent rows are numbered over all levels
+            starts.append(child_starts)
+            ends.append(child_ends)
+            levels.append(np.full(len(child_starts), level))
+            parents.append(child_parents + first_node - len(starts[-2]))
+            first_node += len(child_starts)
+            split = np.flatnonzero((child_ends - child_starts > leaf_size) & (level < max_depth))
+
+        self.starts = np.concatenate(starts)
+        self.ends = np.concatenate(ends)
+        self.levels = np.concatenate(levels)
+        parents = np.concatenate(parents)
+        n_nodes = len(self.starts)
+        self.n_children = np.bincount(parents[1:], minlength=n_nodes)
+        self.first_child = np.zeros(n_nodes, dtype=np.int64)
+        has_children = self.n_children > 0
+        self.first_child[has_children] = np.searchsorted(parents[1:], np.flatnonzero(has_children)) + 1
+        self.sizes = self.root_size / 2.0**self.levels
+
+        # mass and center of mass from prefix sums over the sorted bodies
+        mass = np.concatenate(([0], np.cumsum(self.masses)))
+        moment = np.concatenate((np.zeros((1, 2)), np.cumsum(self.masses[:, None]*self.positions, axis=0)))
+        self.mass = mass[self.ends] - mass[self.starts]
+        self.center = (moment[self.ends] - moment[self.starts]) / np.maximum(self.mass, 1e-300)[:, None]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def accelerations(self, strength=1.0, theta=0.5, softening=1.0, chunk_size=1024):
+        """
+        The (N, 2) accelerations strength * mass * offset / (distance^2 + softening^2)^(3/2) of
+        every body towards all others, in the original body order.
+        """
+        n = len(self.positions)
+        out = np.empty((n, 2))
+        x, y = self.positions[:, 0], self.positions[:, 1]
+        cx, cy = self.center[:, 0], self.center[:, 1]
+        theta2 = theta*theta
+        eps2 = softening*softening
+        leaf = self.n_children == 0
+        # the bodies are sorted, so a chunk is a compact region and shares most of its frontier
+        for chunk_start in range(0, n, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, n)
+            m = chunk_end - chunk_start
+            ax = np.zeros(m)
+            ay = np.zeros(m)
+            target = np.arange(chunk_start, chunk_end)
+            node = np.zeros(m, dtype=np.int64)
+            while len(target):
+                dx = cx[node] - x[target]
+                dy = cy[node] - y[target]
+                d2 = dx*dx + dy*dy
+                size = self.sizes[node]
+                far = size*size < theta2*d2
+                # the far nodes act as one body
+                f = strength*self.mass[node[far]] / ((d2[far] + eps2)*np.sqrt(d2[far] + eps2))
+                local = target[far] - chunk_start
+                ax += np.bincount(local, weights=f*dx[far], minlength=m)
+                ay += np.bincount(local, weights=f*dy[far], minlength=m)
+                # near leaves are summed body by body, without the body itself
+                near_leaf = ~far & leaf[node]
+                if near_leaf.any():
+                    leaf_node = node[near_leaf]
+                    counts = self.ends[leaf_node] - self.starts[leaf_node]
+                    other = ranges(self.starts[leaf_node], counts)
+                    pair_target = np.repeat(target[near_leaf], counts)
+                    keep = other != pair_target
+                    other = other[keep]
+                    pair_target = pair_target[keep]
+                    px = x[other] - x[pair_target]
+                    py = y[other] - y[pair_target]
+                    r2 = px*px + py*py + eps2
+                    f = strength*self.masses[other] / (r2*np.sqrt(r2))
+                    local = pair_target - chunk_start
+                    ax += np.bincount(local, weights=f*px, minlength=m)
+                    ay += np.bincount(local, weights=f*py, minlength=m)
+                # the rest are opened
+                opened = ~far & ~leaf[node]
+                parent = node[opened]
+                counts = self.n_children[parent]
+                target = np.repeat(target[opened], counts)
+                node = ranges(self.first_child[parent], counts)
+            out[chunk_start:chunk_end, 0] = ax
+            out[chunk_start:chunk_end, 1] = ay
+        result = np.empty_like(out)
+        result[self.order] = out
+        return result
+
+def direct_accelerations(positions, masses, strength=1.0, softening=1.0, targets=None, chunk_size=1024):
+    """The brute force O(N^2) sum, for the bodies in targets (indices, default all)."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    masses = np.broadcast_to(np.asarray(masses, dtype=float), (len(positions),))
+    targets = np.arange(len(positions)) if targets is None else np.asarray(targets)
+    out = np.empty((len(targets), 2))
+    # (chunk, N) temporaries, kept to a few million entries
+    chunk_size = max(1, min(chunk_size, 2**22 // max(len(positions), 1)))
+    # a body exerts no force on itself since its offset is zero
+    for start in range(0, len(targets), chunk_size):
+        p = positions[targets[start:start + chunk_size]]
+        dx = positions[None, :, 0] - p[:, 0, None]
+        dy = positions[None, :, 1] - p[:, 1, None]
+        r2 = dx*dx + dy*dy + softening*softening
+        f = strength*masses / (r2*np.sqrt(r2))
+        out[start:start + chunk_size, 0] = (f*dx).sum(axis=1)
+        out[start:start + chunk_size, 1] = (f*dy).sum(axis=1)
+    return out
+
+class BarnesHut:
+    """
+    Mutual gravity as a force of simulation.Simulation: every orbiter has mass 1 and pulls the
+    others with G * mass = strength. The tree is rebuilt on every evaluation.
+    """
+
+    def __init__(self, strength=1.0, theta=0.5, softening=10.0, leaf_size=8):
+        self.strength = strength
+        self.theta = theta
+        self.softening = softening
+        self.leaf_size = leaf_size
+
+    def __call__(self, positions):
+        tree = QuadTree(positions, 1.0, self.leaf_size)
+        return tree.accelerations(self.strength, self.theta, self.softening)
+
+def bench(n, theta, samples, seed=0):
+    rng = np.random.default_rng(seed)
+    # a clumpy disc, closer to a real scene than a uniform square
+    radius = rng.exponential(100.0, n)
+    angle = rng.uniform(0, 2*np.pi, n)
+    positions = np.stack((radius*np.cos(angle), radius*np.sin(angle)), axis=1)
+    masses = rng.uniform(0.5, 1.5, n)
+
+    start = time.perf_counter()
+    tree = QuadTree(positions, masses)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    approx = tree.accelerations(theta=theta)
+    force_time = time.perf_counter() - start
+
+    # the brute force sum for a sample of the bodies, its time is scaled up to all of them
+    targets = np.arange(n) if samples >= n else rng.choice(n, samples, replace=False)
+    start = time.perf_counter()
+    exact = direct_accelerations(positions, masses, targets=targets)
+    direct_time = (time.perf_counter() - start) * n / len(targets)
+
+    error = np.linalg.norm(approx[targets] - exact, axis=1) / np.maximum(np.linalg.norm(exact, axis=1), 1e-300)
+    return {
+        "bodies": n,
+        "theta": theta,
+        "nodes": len(tree),
+        "build_ms": build_time * 1000,
+        "barnes_hut_ms": (build_time + force_time) * 1000,
+        "direct_ms": direct_time * 1000,
+        "direct_sampled": len(targets) < n,
+        "speedup": direct_time / (build_time + force_time),
+        "median_relative_error": float(np.median(error)),
+        "max_relative_error": float(error.max()),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Barnes-Hut against brute force gravity")
+    parser.add_argument("--bodies", type=int, action="append", help="number of bodies, can be repeated (default: 1k, 10k, 100k, 1M)")
+    parser.add_argument("--theta", type=float, action="append", help="opening angle, can be repeated (default: 0.5)")
+    parser.add_argument("--samples", type=int, default=2000, help="bodies the brute force sum is timed and checked on")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n in args.bodies or [1000, 10000, 100000, 1000000]:
+        for theta in args.theta or [0.5]:
+            results.append(bench(n, theta, args.samples))
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cores": os.cpu_count(),
+        "results": results,
+    }
+    txt = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(txt)
+    else:
+        print(txt)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Headless benchmark for software_renderer
+
+python -m software_renderer --bench [options]
+python benchmark.py [options]
+
+Renders a fixed rotation sweep of every bundled mesh into an offscreen surface (SDL dummy
+video driver, no window) and prints per-stage timings, triangles/sec and frames/sec as JSON.
+--save-baseline stores the report (bench_baseline.json by default) and --baseline compares
+a run against it; the exit code is 1 when a mesh got slower than the tolerance allows. Runs
+are matched on mesh, backend and shading, a baseline rendered at another --size is refused
+and the tiled runs are only compared against a baseline recorded on as many cores.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import software_renderer as sr
+
+
+MESHES = [
+    "cylinder.obj",
+    "func.obj",
+    "gear.obj",
+    "monkey.obj",
+    "sphere.obj",
+    "torus.obj",
+    "trident.obj",
+]
+BACKENDS = ["polygon", "zbuffer", "tiled"]
+STAGES = ["project", "shade", "raster"]
+MESH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(MESH_DIR, "bench_baseline.json")
+
+
+def bench_mesh(surface, filename, backend, frames, shading):
+    # the meshes are bundled next to this file
+    path = filename if os.path.exists(filename) else os.path.join(MESH_DIR, filename)
+    start = time.perf_counter()
+    verts, inds = sr.read_obj(path)
+    mesh = sr.as_mesh(verts, inds)
+    load_time = time.perf_counter() - start
+
+    stage_times = dict((stage, 0.0) for stage in STAGES)
+    submitted = 0
+    drawn = 0
+    bg = sr.create_bg()
+    start = time.perf_counter()
+    for frame in range(frames):
+        angle = frame / frames * 2 * math.pi
+        surface.blit(bg, (0, 0))
+        sr.clear_depth(surface.get_size())
+
+        t0 = time.perf_counter()
+        points, world, faces = sr.project_all_tris(sr.camera, mesh.vertices, mesh.indices, angle)
+        t1 = time.perf_counter()
+        normals = mesh.world_normals(faces, sr.model_transform.get_model_matrix(), shading)
+        lit, colors = sr.shade_tris(world, (255, 255, 255), normals)
+        t2 = time.perf_counter()
+        sr.raster_tris(surface, sr.camera, points[lit], world[lit], colors, 0, backend)
+        t3 = time.perf_counter()
+
+        stage_times["project"] += t1 - t0
+        stage_times["shade"] += t2 - t1
+        stage_times["raster"] += t3 - t2
+        submitted += len(inds)
+        drawn += len(colors)
+    total = time.perf_counter() - start
+
+    return {
+        "mesh": filename,
+        "backend": backend,
+        "shading": shading,
+        "frames": frames,
+        "triangles": len(inds),
+        "triangles_drawn_per_frame": drawn / frames,
+        "load_ms": load_time * 1000,
+        "stage_ms": dict((stage, t / frames * 1000) for stage, t in stage_times.items()),
+        "frame_ms": total / frames * 1000,
+        "fps": frames / total,
+        "triangles_per_sec": submitted / total,
+    }
+
+def run(meshes, backends, frames, size, shading="flat"):
+    sr.SCREEN_WIDTH, sr.SCREEN_HEIGHT = size
+    sr.camera.aspect_ratio = size[0] / size[1]
+    surface = pygame.Surface(size)
+    results = []
+    for filename in meshes:
+        for backend in backends:
+            results.append(bench_mesh(surface, filename, backend, frames, shading))
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "cores": os.cpu_count(),
+        "size": list(size),
+        "results": results,
+    }
+
+def run_key(result):
+    # reports from before --shading existed were all flat shaded
+    return (result["mesh"], result["backend"], result.get("shading", "flat"))
+
+def check_size(size, baseline):
+    # the fps of different surface sizes can't be compared
+    if list(size) != list(baseline["size"]):
+        raise ValueError(f"the baseline was rendered at {baseline['size'][0]}x{baseline['size'][1]}, "
+                         f"not at {size[0]}x{size[1]}")
+
+def compare(report, baseline, tolerance):
+    # returns a list of the (mesh, backend, shading) runs whose fps dropped below the baseline
+    check_size(report["size"], baseline)
+    old = dict((run_key(r), r) for r in baseline["results"])
+    regressions = []
+    for result in report["results"]:
+        key = run_key(result)
+        if key not in old:
+            continue
+        if result["backend"] == "tiled" and baseline.get("cores") != report["cores"]:
+            # the tiled backend scales with the cores, other machines' numbers mean nothing
+            result["baseline_skipped"] = f"baseline recorded on {baseline.get('cores')} cores"
+            continue
+        ratio = result["fps"] / old[key]["fps"]
+        result["baseline_ratio"] = ratio
+        if ratio < 1 - tolerance:
+            regressions.append({"mesh": key[0], "backend": key[1], "shading": key[2], "fps": result["fps"], "baseline_fps": old[key]["fps"]})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="headless software_renderer benchmark")
+    parser.add_argument("--bench", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mesh", action="append", help="mesh to render, can be repeated (default: all bundled meshes)")
+    parser.add_argument("--backend", action="append", choices=BACKENDS, help="raster backend, can be repeated (default: all)")
+    parser.add_argument("--shading", choices=["flat", "gouraud"], default="flat")
+    parser.add_argument("--frames", type=int, default=36, help="frames per rotation sweep")
+    parser.add_argument("--workers", type=int, help="worker processes of the tiled backend (default: number of cores)")
+    parser.add_argument("--size", type=int, nargs=2, default=(800, 600), metavar=("W", "H"))
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="compare against this report")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_FILE, help="save the report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative fps drop before a regression is reported")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        try:
+            check_size(args.size, baseline)
+        except ValueError as error:
+            parser.error(str(error))
+
+    pygame.init()
+    sr.tile_workers = args.workers
+    report = run(args.mesh or MESHES, args.backend or BACKENDS, args.frames, tuple(args.size), args.shading)
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        report["regressions"] = regressions
+
+    txt = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(txt)
+    else:
+        print(txt)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            file.write(txt)
+
+    for regression in regressions:
+        print(f"regression: {regression['mesh']} ({regression['backend']}, {regression['shading']}) {regression['fps']:.1f} fps, baseline {regression['baseline_fps']:.1f} fps", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
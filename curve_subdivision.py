@@ -0,0 +1,86 @@
+"""
+Closed curve subdivision on NumPy arrays
+
+Every level inserts the midpoint of each edge and moves the old points to
+1/8 previous + 3/4 point + 1/8 next (the stencil loop_subsurf used, a cubic B-spline), with
+the curve stored as an (N, 2) array and the stencil applied with rolls.
+
+SubdivisionCurve keeps every level. The stencil only reaches one point to each side, so
+moving a single control point changes 5 points of the first level, 13 of the second and so
+on; move_point recomputes just that window of every level instead of the whole curve.
+"""
+import numpy as np
+
+
+def subdivide(points):
+    # one level, (N, 2) -> (2N, 2), curves with less than 3 points are returned as they are
+    points = np.asarray(points, dtype=float)
+    if len(points) < 3:
+        return points
+    prev = np.roll(points, 1, axis=0)
+    nxt = np.roll(points, -1, axis=0)
+    out = np.empty((2*len(points),) + points.shape[1:])
+    out[0::2] = 0.125*prev + 0.75*points + 0.125*nxt
+    out[1::2] = (points + nxt) / 2
+    return out
+
+def subdivide_window(points, out, start, stop):
+    # recompute out[start:stop] (indices taken modulo len(out)) of the level after points
+    n = len(points)
+    i = np.arange(start, stop)
+    k = i // 2
+    even = i % 2 == 0
+    p = points[k % n]
+    nxt = points[(k + 1) % n]
+    prv = points[(k - 1) % n]
+    values = np.where(even[:, None], 0.125*prv + 0.75*p + 0.125*nxt, (p + nxt) / 2)
+    out[i % len(out)] = values
+
+class SubdivisionCurve:
+
+    def __init__(self, points=(), levels=1):
+        self.n_levels = max(levels, 0)
+        self.set_points(points)
+
+    def set_points(self, points):
+        # new control points (or a different number of them), rebuilds every level
+        self.levels = [np.array(points, dtype=float).reshape(-1, 2)]
+        self.extend()
+
+    def set_levels(self, levels):
+        # levels that were already computed are kept, missing ones are computed from the last one
+        self.n_levels = max(levels, 0)
+        del self.levels[self.n_levels + 1:]
+        self.extend()
+
+    def extend(self):
+        while len(self.levels) <= self.n_levels:
+            self.levels.append(subdivide(self.levels[-1]))
+
+    @property
+    def control_points(self):
+        return self.levels[0]
+
+    @property
+    def curve(self):
+        return self.levels[-1]
+
+    def move_point(self, index, position):
+        """Move control point index and update the part of every level it influences."""
+        self.levels[0][index] = position
+        if len(self.levels[0]) < 3:
+            for level in range(1, len(self.levels)):
+                self.levels[level] = self.levels[0].copy()
+            return
+        # the dirty window [start, stop) of the current level, indices not yet wrapped
+        start, stop = index, index + 1
+        for level in range(1, len(self.levels)):
+            parent = self.levels[level - 1]
+            child = self.levels[level]
+            start, stop = 2*start - 2, 2*stop + 1
+            if stop - start >= len(child):
+                # the window covers the whole curve from here on
+                for rest in range(level, len(self.levels)):
+                    self.levels[rest] = subdivide(self.levels[rest - 1])
+                return
+            subdivide_window(parent, child, start, stop)
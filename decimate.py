@@ -0,0 +1,244 @@
+"""
+Level of detail through quadric error mesh decimation (Garland & Heckbert)
+
+build_lods simplifies a mesh into a chain of coarser meshes by collapsing the edge with the
+smallest quadric error first. Every level stores its error (the largest distance a collapse
+moved the surface, in object units), so the renderer can pick the coarsest level whose error
+projected to the screen stays under a pixel budget. load_lods caches the chain next to the
+.obj file and rebuilds it when the file changes.
+"""
+import heapq
+import os
+
+import numpy as np
+
+from mesh import Mesh
+from mesh_cache import file_hash
+
+
+LOD_RATIOS = (1.0, 0.5, 0.25, 0.125, 0.0625)
+LODS_SUFFIX = ".lods.npz"
+# weight of the planes that keep open borders in place
+BORDER_WEIGHT = 100.0
+
+
+def face_quadrics(verts, faces):
+    # area weighted plane quadric of every face, (M, 4, 4)
+    v0, v1, v2 = verts[faces[:, 0]], verts[faces[:, 1]], verts[faces[:, 2]]
+    normals = np.cross(v1 - v0, v2 - v0)
+    areas = np.sqrt((normals*normals).sum(axis=1))
+    normals = normals / np.where(areas > 0, areas, 1)[:, None]
+    planes = np.concatenate((normals, -(normals*v0).sum(axis=1)[:, None]), axis=1)
+    return planes[:, :, None]*planes[:, None, :]*(areas / 2)[:, None, None]
+
+def border_quadrics(verts, faces):
+    # planes through the open edges, perpendicular to their face, so borders don't shrink
+    edges = np.concatenate((faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]))
+    face_of_edge = np.tile(np.arange(len(faces)), 3)
+    key = np.sort(edges, axis=1)
+    _, inverse, counts = np.unique(key, axis=0, return_inverse=True, return_counts=True)
+    border = counts[inverse.ravel()] == 1
+    edges, face_of_edge = edges[border], face_of_edge[border]
+    if not len(edges):
+        return edges, np.empty((0, 4, 4))
+
+    a, b = verts[edges[:, 0]], verts[edges[:, 1]]
+    f = faces[face_of_edge]
+    face_normal = np.cross(verts[f[:, 1]] - verts[f[:, 0]], verts[f[:, 2]] - verts[f[:, 0]])
+    normals = np.cross(b - a, face_normal)
+    lengths = np.sqrt((normals*normals).sum(axis=1))
+    normals = normals / np.where(lengths > 0, lengths, 1)[:, None]
+    planes = np.concatenate((normals, -(normals*a).sum(axis=1)[:, None]), axis=1)
+    return edges, planes[:, :, None]*planes[:, None, :]*BORDER_WEIGHT
+
+def vertex_quadrics(verts, faces):
+    # returns the quadric of every vertex and the face area it was accumulated from
+    quadrics = np.zeros((len(verts), 4, 4))
+    v0, v1, v2 = verts[faces[:, 0]], verts[faces[:, 1]], verts[faces[:, 2]]
+    areas = np.sqrt((np.cross(v1 - v0, v2 - v0)**2).sum(axis=1)) / 2
+    weights = np.zeros(len(verts))
+    face_q = face_quadrics(verts, faces).reshape(-1, 16)
+    flat = quadrics.reshape(-1, 16)
+    for corner in range(3):
+        weights += np.bincount(faces[:, corner], weights=areas, minlength=len(verts))
+        for k in range(16):
+            flat[:, k] += np.bincount(faces[:, corner], weights=face_q[:, k], minlength=len(verts))
+    edges, border_q = border_quadrics(verts, faces)
+    border_q = border_q.reshape(-1, 16)
+    for end in range(2):
+        for k in range(16):
+            flat[:, k] += np.bincount(edges[:, end], weights=border_q[:, k], minlength=len(verts)) if len(edges) else 0
+    return quadrics, weights
+
+def collapse_target(q, a, b):
+    # the point minimizing the quadric, or the best of the endpoints and the midpoint
+    try:
+        if abs(np.linalg.det(q[:3, :3])) > 1e-12:
+            p = np.linalg.solve(q[:3, :3], -q[:3, 3])
+            return p, max(float(p @ q[:3, :3] @ p + 2*(q[:3, 3] @ p) + q[3, 3]), 0.0)
+    except np.linalg.LinAlgError:
+        pass
+    best = None
+    for p in (a, b, (a + b) / 2):
+        cost = float(p @ q[:3, :3] @ p + 2*(q[:3, 3] @ p) + q[3, 3])
+        if best is None or cost < best[1]:
+            best = (p, max(cost, 0.0))
+    return best
+
+def simplify(verts, faces, target_faces):
+    """
+    Collapse edges until at most target_faces faces are left.
+    Returns (vertices, faces, error) with error the largest (approximate) distance a collapse
+    moved the surface.
+    """
+    verts = np.array(verts, dtype=float)
+    faces = np.array(faces, dtype=np.int64)
+    quadrics, weights = vertex_quadrics(verts, faces)
+    alive_faces = np.ones(len(faces), dtype=bool)
+    alive_verts = np.ones(len(verts), dtype=bool)
+    version = np.zeros(len(verts), dtype=np.int64)
+    vertex_faces = [set() for _ in range(len(verts))]
+    for f, face in enumerate(faces.tolist()):
+        for v in face:
+            vertex_faces[v].add(f)
+
+    heap = []
+    def push(u, v):
+        target, cost = collapse_target(quadrics[u] + quadrics[v], verts[u], verts[v])
+        heapq.heappush(heap, (cost, u, v, int(version[u]), int(version[v]), target))
+
+    edges = np.unique(np.sort(np.concatenate((faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]])), axis=1), axis=0)
+    for u, v in edges.tolist():
+        push(u, v)
+
+    n_faces = len(faces)
+    error = 0.0
+    while n_faces > target_faces and heap:
+        cost, u, v, version_u, version_v, target = heapq.heappop(heap)
+        if not (alive_verts[u] and alive_verts[v]) or version[u] != version_u or version[v] != version_v:
+            continue
+
+        shared = vertex_faces[u] & vertex_faces[v]
+        if not shared:
+            continue
+        # link condition: u and v may only share the neighbors across their shared faces,
+        # anything else would pinch the surface into a non-manifold edge
+        around_u = set(faces[list(vertex_faces[u])].ravel().tolist())
+        around_v = set(faces[list(vertex_faces[v])].ravel().tolist())
+        opposite = set(faces[list(shared)].ravel().tolist())
+        if (around_u & around_v) - opposite:
+            continue
+        # refuse collapses that would flip a face that survives
+        flips = False
+        for f in (vertex_faces[u] | vertex_faces[v]) - shared:
+            corners = verts[faces[f]]
+            before = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+            moved = corners.copy()
+            moved[(faces[f] == u) | (faces[f] == v)] = target
+            after = np.cross(moved[1] - moved[0], moved[2] - moved[0])
+            if before @ after <= 0:
+                flips = True
+                break
+        if flips:
+            continue
+
+        for f in shared:
+            alive_faces[f] = False
+            for w in faces[f].tolist():
+                vertex_faces[w].discard(f)
+        n_faces -= len(shared)
+        for f in vertex_faces[v]:
+            faces[f][faces[f] == v] = u
+            vertex_faces[u].add(f)
+        vertex_faces[v] = set()
+        alive_verts[v] = False
+        verts[u] = target
+        quadrics[u] += quadrics[v]
+        weights[u] += weights[v]
+        version[u] += 1
+        # the quadrics are area weighted, divide the area out again to get a squared distance
+        error = max(error, cost / max(weights[u], 1e-12))
+
+        neighbors = set()
+        for f in vertex_faces[u]:
+            neighbors.update(faces[f].tolist())
+        neighbors.discard(u)
+        for w in neighbors:
+            push(min(u, w), max(u, w))
+
+    # compact the surviving vertices
+    faces = faces[alive_faces]
+    used, remap = np.unique(faces, return_inverse=True)
+    return verts[used], remap.reshape(-1, 3), float(np.sqrt(error))
+
+class LodChain:
+
+    def __init__(self, levels, errors):
+        self.levels = levels # Mesh per level, finest first
+        self.errors = errors # object space error of every level, 0 for the original
+
+    def select(self, pixels_per_unit, error_budget=1.0):
+        # the coarsest level whose error covers at most error_budget pixels on the screen
+        for level in range(len(self.levels) - 1, 0, -1):
+            if self.errors[level]*pixels_per_unit <= error_budget:
+                return level
+        return 0
+
+def build_lods(verts, inds, ratios=LOD_RATIOS):
+    """Simplify the mesh to every ratio of its face count, each level starting from the previous one."""
+    verts = np.asarray(verts, dtype=float).reshape(-1, 3)
+    inds = np.asarray(inds, dtype=np.int64).reshape(-1, 3)
+    levels = [Mesh(verts, inds)]
+    errors = [0.0]
+    n_faces = len(inds)
+    for ratio in ratios[1:]:
+        target = max(int(n_faces*ratio), 4)
+        verts, inds, error = simplify(verts, inds, target)
+        levels.append(Mesh(verts, inds))
+        # errors add up along the chain
+        errors.append(errors[-1] + error)
+    return LodChain(levels, errors)
+
+def lods_path(filename):
+    return filename + LODS_SUFFIX
+
+def load_lods(filename, loader, ratios=LOD_RATIOS):
+    """
+    The LodChain of an .obj file, cached in <name>.obj.lods.npz and rebuilt when the .obj
+    file (or the requested ratios) change. loader is called like mesh_cache.load_mesh.
+    """
+    path = lods_path(filename)
+    stat = os.stat(filename)
+    try:
+        with np.load(path) as data:
+            valid = (
+                    int(data["source_size"]) == stat.st_size
+                    and np.array_equal(data["ratios"], ratios)
+                    and (int(data["source_mtime"]) == stat.st_mtime_ns or bytes(data["source_hash"]) == file_hash(filename))
+            )
+            if valid:
+                levels = [Mesh(data[f"vertices_{i}"], data[f"indices_{i}"]) for i in range(len(ratios))]
+                return LodChain(levels, data["errors"].tolist())
+    except (OSError, KeyError, ValueError):
+        pass
+
+    verts, inds = loader(filename)
+    chain = build_lods(verts, inds, ratios)
+    arrays = {
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime_ns,
+        "source_hash": np.frombuffer(file_hash(filename), dtype=np.uint8),
+        "ratios": np.asarray(ratios, dtype=float),
+        "errors": np.asarray(chain.errors),
+    }
+    for i, level in enumerate(chain.levels):
+        arrays[f"vertices_{i}"] = level.vertices.astype(np.float32)
+        arrays[f"indices_{i}"] = level.indices.astype(np.int32)
+    try:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return chain
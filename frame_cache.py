@@ -0,0 +1,56 @@
+"""
+Retained-mode frame cache
+
+The mesh layer (background plus rendered mesh) is kept in an offscreen surface and only
+rendered again when the state it was rendered from changes. Every render reports the
+rectangles of the screen that changed (the area the mesh covered before and after), so the
+caller can restore just those from the layer and push just those to the display. A frame
+where nothing changed does no drawing at all.
+"""
+import pygame
+
+
+class FrameCache:
+
+    def __init__(self):
+        self.layer = None
+        self.key = None
+        self.mesh_rect = None
+
+    def invalidate(self):
+        # render again on the next update even if the key is the same
+        self.key = None
+
+    def update(self, key, size, render):
+        """
+        Render the layer again if key (any comparable snapshot of the state the frame depends
+        on) or the size changed. render(layer) draws the layer and returns the rectangle the
+        mesh covers, or None. Returns the dirty rectangles, empty when nothing changed.
+        """
+        if self.layer is not None and self.layer.get_size() == tuple(size) and key == self.key:
+            return []
+        resized = self.layer is None or self.layer.get_size() != tuple(size)
+        if resized:
+            self.layer = pygame.Surface(size)
+        self.key = key
+        mesh_rect = render(self.layer)
+        old_rect = self.mesh_rect
+        self.mesh_rect = mesh_rect
+
+        if resized:
+            return [self.layer.get_rect()]
+        if old_rect is None and mesh_rect is None:
+            return []
+        if old_rect is None:
+            rect = mesh_rect
+        elif mesh_rect is None:
+            rect = old_rect
+        else:
+            rect = old_rect.union(mesh_rect)
+        rect = rect.clip(self.layer.get_rect())
+        return [rect] if rect.width and rect.height else []
+
+    def restore(self, surface, rects):
+        # copy the given rectangles of the layer to the surface
+        for rect in rects:
+            surface.blit(self.layer, rect, rect)
@@ -5,14 +5,21 @@ How to use
 
 left click on the blue circles, then move your mouse around to rotate the part that is selected
 right click to deselect
+press I to make the tip of the blue part follow the mouse (inverse kinematics), M switches
+between the CCD and damped least squares solvers
 
 Pass the --debug-enabled argument when running the program to enable debugging - but why would you? :|
+Pass --rig N to watch a generated rig with N parts instead (drawn through skeleton.Skeleton)
 """
 import pygame
 import sys
 import numpy as np
 import math
 
+from ik import IKSolver
+from skeleton import Skeleton
+from spatial_hash import SpatialHash
+
 
 class MathUtil:
     
@@ -60,13 +67,25 @@ class Square:
                 color=pygame.math.Vector3(255, 255, 255),
                 parent=None,
                  ):
+        # scene graph node, the local and world matrices are cached and only rebuilt when
+        # rotation, position or scale (of the node or one of its parents) were assigned
+        self.parent = parent
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+        self.local_transform = None
+        self.world_transform = None
+        self.local_dirty = True
+        self.world_dirty = True
+        # counts the rebuilds of the world matrix, lets the picker know the gizmo moved
+        self.world_version = 0
+
         self.position = position
         self.scale = pygame.math.Vector2(1, 1)
         self.rotation = rotation
         self.temp_rotation = self.rotation
         self.origin = origin
         self.color = color
-        self.parent = parent
         self.gizmo_radius = 50
         self.mouse_last = pygame.math.Vector2()
 
@@ -78,7 +97,49 @@ class Square:
                 pygame.math.Vector2(0, scale.y),
                 ] 
 
+    # assign a new value (not e.g. square.position.x += 1) so the cached matrices are rebuilt
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = pygame.math.Vector2(position)
+        self.set_dirty()
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale):
+        self._scale = pygame.math.Vector2(scale)
+        self.set_dirty()
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self._rotation = rotation
+        self.set_dirty()
+
+    def set_dirty(self):
+        self.local_dirty = True
+        self.set_world_dirty()
+
+    def set_world_dirty(self):
+        # a dirty node always has dirty descendants, so the walk stops at the first dirty one
+        if self.world_dirty:
+            return
+        self.world_dirty = True
+        for child in self.children:
+            child.set_world_dirty()
+
     def get_local_transform(self):
+        if not self.local_dirty:
+            return self.local_transform
         scale = MathUtil.scale(self.scale)
         rot = MathUtil.rotate(self.rotation)
         tra = MathUtil.translate(self.position)
@@ -90,27 +151,40 @@ class Square:
         tr = rot @ tr
         tr = MathUtil.translate(-to_origin) @ tr
         tr = tra @ tr
+        self.local_transform = tr
+        self.local_dirty = False
         return tr
 
 
     def get_global_transform(self):
+        if not self.world_dirty:
+            return self.world_transform
         if self.parent is None:
-            return self.get_local_transform()
-        
-        local_transform = self.get_local_transform()
-        parent_transform = self.parent.get_global_transform()
-        return parent_transform @ local_transform
+            self.world_transform = self.get_local_transform()
+        else:
+            self.world_transform = self.parent.get_global_transform() @ self.get_local_transform()
+        self.world_dirty = False
+        self.world_version += 1
+        return self.world_transform
+
+    def update_transforms(self):
+        # one top-down pass over the subtree, every dirty world matrix is rebuilt exactly once
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node.get_global_transform()
+            stack.extend(node.children)
+
+    def get_global_origin(self):
+        return MathUtil.apply_transform(self.get_global_transform(), self.origin)
 
     def transform_points(self):
+        # all corners with one matmul
+        tr = self.get_global_transform()
+        corners = np.array([[point.x, point.y, 1] for point in self.points]) @ tr.T
+        return [pygame.math.Vector2(x, y) for x, y, _ in corners.tolist()]
 
-        points = []
-        for i, point in enumerate(self.points):
-            p = MathUtil.apply_transform(self.get_global_transform(), point)
-            points.append(p)
-
-        return points
-
-    def draw(self, surf=None, debug=False):
+    def draw(self, surf=None, debug=False, mouse_position=None):
         surface = pygame.display.get_surface() if surf is None else surf
 
         points = self.transform_points()
@@ -120,8 +194,9 @@ class Square:
                 pygame.draw.circle(surface, (255, 255, 0), point, 5)
             pygame.draw.polygon(surface, pygame.math.Vector3(255, 0, 0).lerp(self.color, 0.5), points, 1)
 
-        origin = MathUtil.apply_transform(self.get_global_transform(), self.origin)
-        mouse_position = pygame.math.Vector2(*pygame.mouse.get_pos())
+        origin = self.get_global_origin()
+        if mouse_position is None:
+            mouse_position = pygame.math.Vector2(*pygame.mouse.get_pos())
 
         if selected_square is not self:
             pygame.draw.circle(surface, pygame.math.Vector3(0, 0, 100), origin, self.gizmo_radius, 2)
@@ -139,20 +214,16 @@ class Square:
             wage_points.append(origin)
             pygame.draw.polygon(surface, (255, 255, 255), wage_points)
 
-    def update(self, delta):
-
-        global selected_square
-        if pygame.mouse.get_pressed()[0]:
-            if self.mouse_inside_gizmo():
-                selected_square = self
-                self.temp_rotation = self.rotation
-                self.mouse_last = pygame.math.Vector2(*pygame.mouse.get_pos())
-        elif pygame.mouse.get_pressed()[2]:
-            selected_square = None
+    def grab(self, mouse_position):
+        # the rotation is measured from here while the square is selected
+        self.temp_rotation = self.rotation
+        self.mouse_last = pygame.math.Vector2(mouse_position)
 
-        if selected_square is self: 
-            origin = MathUtil.apply_transform(self.get_global_transform(), self.origin)
-            mouse_position = pygame.math.Vector2(*pygame.mouse.get_pos())
+    def update(self, delta, mouse_position):
+        # rotates the selected square, selection itself is done by InputDispatcher
+        if selected_square is self:
+            origin = self.get_global_origin()
+            mouse_position = pygame.math.Vector2(mouse_position)
             to_mouse_position = (mouse_position - origin).normalize()
             to_mouse_last = (self.mouse_last - origin).normalize()
 
@@ -173,20 +244,120 @@ class Square:
                 pass
             self.rotation = self.temp_rotation + angle
 
-    def mouse_inside_gizmo(self):
-        origin = MathUtil.apply_transform(self.get_global_transform(), self.origin)
-        mouse_position = pygame.math.Vector2(*pygame.mouse.get_pos())
+    def mouse_inside_gizmo(self, mouse_position=None):
+        origin = self.get_global_origin()
+        if mouse_position is None:
+            mouse_position = pygame.math.Vector2(*pygame.mouse.get_pos())
 
         to_mouse = mouse_position - origin
         return to_mouse.dot(to_mouse) <= self.gizmo_radius**2
 
 selected_square = None
+class InputDispatcher:
+    """
+    Reads the mouse once per frame and hands it to the squares. The gizmo origins are kept in
+    a spatial hash, a square is only moved in it when its world matrix was rebuilt, and a click
+    selects the square with the nearest gizmo (not the last one tested).
+    """
+
+    def __init__(self, squares):
+        self.squares = list(squares)
+        self.radius = max(square.gizmo_radius for square in self.squares)
+        self.grid = SpatialHash(cell_size=2*self.radius)
+        self.origins = [None]*len(self.squares)
+        self.versions = [None]*len(self.squares)
+        self.mouse_position = pygame.math.Vector2()
+        self.buttons = (False, False, False)
+
+    def refresh(self):
+        for i, square in enumerate(self.squares):
+            square.get_global_transform()
+            if square.world_version != self.versions[i]:
+                self.versions[i] = square.world_version
+                origin = square.get_global_origin()
+                self.origins[i] = origin
+                self.grid.move(i, origin.x, origin.y)
+
+    def pick(self, position):
+        """The square with the nearest gizmo containing position, None if there is none."""
+        self.refresh()
+        position = pygame.math.Vector2(position)
+        nearest = None
+        nearest_distance = None
+        for i in self.grid.query(position.x, position.y, self.radius):
+            distance = position.distance_squared_to(self.origins[i])
+            if distance <= self.squares[i].gizmo_radius**2 and (nearest is None or distance < nearest_distance):
+                nearest = i
+                nearest_distance = distance
+        return None if nearest is None else self.squares[nearest]
+
+    def update(self, delta):
+        global selected_square
+        self.mouse_position = pygame.math.Vector2(*pygame.mouse.get_pos())
+        self.buttons = pygame.mouse.get_pressed()
+        if self.buttons[0]:
+            square = self.pick(self.mouse_position)
+            if square is not None:
+                selected_square = square
+                square.grab(self.mouse_position)
+        elif self.buttons[2]:
+            selected_square = None
+        if selected_square is not None:
+            selected_square.update(delta, self.mouse_position)
+
+# seconds of inverse kinematics per frame, the arm catches up over the next frames if it runs out
+ik_time_budget = 0.002
+
+def create_rig(n_parts, seed=0):
+    # a random tree of arms growing from a root in the middle of the window
+    rng = np.random.default_rng(seed)
+    parents = np.concatenate(([-1], rng.integers(0, np.arange(1, n_parts))))
+    lengths = rng.uniform(10, 30, n_parts)
+    sizes = np.stack((np.full(n_parts, 6.0), lengths), axis=1)
+    # every part rotates around the middle of its base (origin), which sits on the tip of its parent
+    origins = np.stack((np.full(n_parts, 3.0), lengths), axis=1)
+    positions = np.stack((np.zeros(n_parts), -lengths), axis=1)
+    positions[0] = (397, 300 - lengths[0])
+    colors = rng.integers(60, 256, (n_parts, 3))
+    rotations = rng.uniform(-0.8, 0.8, n_parts)
+    return Skeleton(parents, positions, sizes, rotations, origins=origins, colors=colors)
+
+def run_rig(screen, n_parts):
+    rig = create_rig(n_parts)
+    rest = rig.rotations.copy()
+    phase = np.random.default_rng(1).uniform(0, 2*math.pi, n_parts)
+    clock = pygame.time.Clock()
+    t = 0
+    while True:
+        screen.fill((0, 0, 0))
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+        rig.rotations = rest + 0.3*np.sin(t + phase)
+        rig.forward_kinematics()
+        rig.draw(screen)
+        pygame.display.update()
+        t += clock.tick()/1000
+        pygame.display.set_caption(f"Hierarchical modeling - {n_parts} parts, {clock.get_fps():.0f} fps")
+
+def option(name, convert):
+    # the value following name on the command line, None if name wasn't passed
+    if name not in sys.argv:
+        return None
+    try:
+        return convert(sys.argv[sys.argv.index(name) + 1])
+    except (IndexError, ValueError):
+        sys.exit(f"{name} needs a value\n{__doc__}")
 
 def main():
+    n_parts = option("--rig", int)
     pygame.init()
 
     screen = pygame.display.set_mode((800, 600))
     pygame.display.set_caption("Hierarchical modeling")
+    if n_parts is not None:
+        run_rig(screen, n_parts)
 
     square1 = Square(
             position=pygame.math.Vector2(370, 200),
@@ -222,6 +393,11 @@ def main():
             )
 
 
+    squares = [square1, square2, square3, square4]
+    dispatcher = InputDispatcher(squares)
+    ik = IKSolver(square4, time_budget=ik_time_budget)
+    ik_enabled = False
+
     clock = pygame.time.Clock()
     delta = 0
     debug_enabled = False
@@ -236,16 +412,23 @@ def main():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
-
-        square1.update(delta)
-        square2.update(delta)
-        square3.update(delta)
-        square4.update(delta)
-
-        square1.draw(debug=debug_enabled)
-        square2.draw(debug=debug_enabled)
-        square3.draw(debug=debug_enabled)
-        square4.draw(debug=debug_enabled)
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_i:
+                    ik_enabled = not ik_enabled
+                elif event.key == pygame.K_m:
+                    ik.method = "ccd" if ik.method == "dls" else "dls"
+
+        dispatcher.update(delta)
+        mouse_position = dispatcher.mouse_position
+        if ik_enabled:
+            ik.solve(mouse_position)
+        square1.update_transforms()
+
+        for square in squares:
+            square.draw(debug=debug_enabled, mouse_position=mouse_position)
+        if ik_enabled:
+            pygame.draw.circle(screen, (255, 255, 0), mouse_position, 5, 1)
+            pygame.display.set_caption(f"Hierarchical modeling - IK ({ik.method}), error {ik.error:.1f}")
 
         pygame.display.update()
         clock.tick()
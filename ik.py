@@ -0,0 +1,155 @@
+"""
+Inverse kinematics for chains of hierarchical_modeling.Square parts
+
+IKSolver poses the chain from a root down to an end effector so that a point of the effector
+reaches a target, every part of the chain is a joint rotating around its origin. The chain is
+read into arrays: the local matrices are built in one batch (skeleton.local_matrices) and the
+world matrices of the whole chain are their prefix products, computed with log2(n) batched
+matmuls. The Jacobian comes straight from those world matrices: rotating joint i moves the
+effector by M K M^-1 (effector - pivot_i), M being the joint's world rotation part and K the
+derivative of a rotation, no finite differences needed.
+
+Two solvers, both resuming from the current pose every frame:
+    ccd: cyclic coordinate descent, every sweep turns each joint (effector first) so the
+         effector points at the target
+    dls: damped least squares, all joints at once, dtheta = J^T (J J^T + damping^2 I)^-1 error
+Solving stops at the tolerance, after max_iterations or when time_budget seconds have passed,
+so a long chain never drops the frame rate, it just takes a few frames to get there.
+"""
+import math
+import time
+
+import numpy as np
+
+from skeleton import local_matrices
+
+
+def prefix_products(mats):
+    # out[i] = mats[0] @ mats[1] @ ... @ mats[i], an inclusive scan with log2(n) batched matmuls
+    out = mats.copy()
+    step = 1
+    while step < len(out):
+        out[step:] = out[:-step] @ out[step:]
+        step *= 2
+    return out
+
+def chain_jacobian(world, pivots, scales, effector):
+    """
+    The (2, n) Jacobian of the effector position with respect to the joint rotations.
+    world[i] = parent @ translate(position) @ rotate around origin @ scale(scales[i]), so the
+    rotating part of it (parent @ rotate) is world[i][:2, :2] without the scale.
+    """
+    linear = world[:, :2, :2] / scales[:, None, :]
+    offsets = effector - pivots
+    # rotate(angle)^-1 @ d/dangle rotate(angle) = [[0, 1], [-1, 0]]
+    local = np.linalg.solve(linear, offsets[:, :, None])[:, :, 0]
+    turned = np.stack((local[:, 1], -local[:, 0]), axis=1)
+    return (linear @ turned[:, :, None])[:, :, 0].T
+
+def ccd_sweep(rotations, pivots, effector, target):
+    # one sweep from the effector to the root, updates rotations in place and returns the effector
+    ex, ey = effector.tolist()
+    tx, ty = target.tolist()
+    for i in range(len(rotations) - 1, -1, -1):
+        px, py = pivots[i].tolist()
+        vx, vy = ex - px, ey - py
+        wx, wy = tx - px, ty - py
+        angle = math.atan2(vx*wy - vy*wx, vx*wx + vy*wy)
+        # a growing rotation turns the other way round than atan2 (see chain_jacobian)
+        rotations[i] -= angle
+        c, s = math.cos(angle), math.sin(angle)
+        ex, ey = px + c*vx - s*vy, py + s*vx + c*vy
+    return np.array([ex, ey])
+
+def dls_step(jacobian, error, damping, max_step):
+    # damped least squares, the step is scaled down so no joint turns more than max_step
+    jjt = jacobian @ jacobian.T + damping**2 * np.eye(2)
+    step = jacobian.T @ np.linalg.solve(jjt, error)
+    largest = np.abs(step).max()
+    if largest > max_step:
+        step *= max_step / largest
+    return step
+
+class IKSolver:
+
+    def __init__(self, effector, root=None, local_point=None, method="dls",
+                 damping=10.0, max_step=0.2, tolerance=0.5, max_iterations=50, time_budget=0.002):
+        # the chain goes up from the effector to root (or to the top of the hierarchy)
+        chain = [effector]
+        while chain[-1] is not root and chain[-1].parent is not None:
+            chain.append(chain[-1].parent)
+        self.squares = chain[::-1]
+        # by default the effector point is the origin mirrored through the middle of the part,
+        # the tip of a part that turns around the middle of its base
+        if local_point is None:
+            local_point = effector.points[2] - effector.origin
+        self.local_point = np.array([local_point[0], local_point[1], 1.0])
+        self.method = method
+        self.damping = damping
+        self.max_step = max_step
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.time_budget = time_budget
+        self.iterations = 0
+        self.error = 0.0
+
+    def read(self):
+        # the parameters of the chain as arrays, the parts may have been edited since the last solve
+        squares = self.squares
+        self.positions = np.array([tuple(square.position) for square in squares], dtype=float)
+        self.scales = np.array([tuple(square.scale) for square in squares], dtype=float)
+        self.origins = np.array([tuple(square.origin) for square in squares], dtype=float)
+        self.rotations = np.array([square.rotation for square in squares], dtype=float)
+        parent = squares[0].parent
+        self.base = np.eye(3) if parent is None else parent.get_global_transform()
+
+    def forward(self, rotations):
+        """The world matrices, world pivots and the world effector point for rotations."""
+        mats = local_matrices(self.positions, rotations, self.scales, self.origins)
+        mats[0] = self.base @ mats[0]
+        world = prefix_products(mats)
+        # the center of rotation, the rotation happens after the scale so it is origin / scale
+        # in the coordinates of the part (the same as Square.get_global_origin without a scale)
+        pivots = (world[:, :2, :2] @ (self.origins / self.scales)[:, :, None])[:, :, 0] + world[:, :2, 2]
+        effector = (world[-1] @ self.local_point)[:2]
+        return world, pivots, effector
+
+    def effector_position(self):
+        self.read()
+        return self.forward(self.rotations)[2]
+
+    def solve(self, target, method=None, time_budget=None):
+        """
+        Move the chain towards target (world space), returns the number of iterations used.
+        The rotations are written back to the squares, which marks their matrices dirty.
+        """
+        start = time.perf_counter()
+        method = self.method if method is None else method
+        time_budget = self.time_budget if time_budget is None else time_budget
+        self.read()
+        target = np.asarray(target, dtype=float)
+        rotations = self.rotations.copy()
+
+        iterations = 0
+        while True:
+            world, pivots, effector = self.forward(rotations)
+            error = target - effector
+            if (iterations >= self.max_iterations
+                    or error @ error <= self.tolerance**2
+                    or time.perf_counter() - start > time_budget):
+                break
+            if method == "ccd":
+                ccd_sweep(rotations, pivots, effector, target)
+            elif method == "dls":
+                jacobian = chain_jacobian(world, pivots, self.scales, effector)
+                rotations += dls_step(jacobian, error, self.damping, self.max_step)
+            else:
+                raise ValueError(f"unknown IK method {method!r}")
+            iterations += 1
+
+        for square, old, new in zip(self.squares, self.rotations.tolist(), rotations.tolist()):
+            if new != old:
+                square.rotation = new
+        self.iterations = iterations
+        self.error = math.sqrt(error @ error)
+        return iterations
@@ -9,97 +9,102 @@ Right arrow to increase the number of subdivisions
 import pygame
 import sys
 
+import numpy as np
+
+from curve_subdivision import SubdivisionCurve
+from spatial_hash import SpatialHash
+
 
 pygame.init()
 
 screen = pygame.display.set_mode((800, 600))
 pygame.display.set_caption("Loop Subdivision surface in 2D")
 
-class Point:
-
-    def __init__(self, position, is_control_point=True):
-        self.position = pygame.math.Vector2(*position)
-        self.is_control_point = is_control_point
-        self.radius = 5
-        self.color = (255, 255, 255)
-
-    def update(self):
-        global active_point
-
-        if active_point is self:
-            self.position = pygame.math.Vector2(*pygame.mouse.get_pos()) - pygame.math.Vector2(10, 10)
-        else:
-            if pygame.mouse.get_pressed()[0] and self.is_mouse_inside():
-                active_point = self
-
-    def is_mouse_inside(self):
-        mouse_pos = pygame.math.Vector2(*pygame.mouse.get_pos())
-        pos_diff = mouse_pos - self.position
-        return pos_diff.dot(pos_diff) <= self.radius**2
-            
-    def draw(self):
-        global active_point
-        if active_point is self:
-            pygame.draw.circle(screen, (255, 255, 0), self.position, self.radius)
-        else:
-            pygame.draw.circle(screen, self.color, self.position, self.radius)
-
-    def copy(self):
-        return Point(self.position.copy(), self.is_control_point)
-
-def draw_dotted_polygon(points, dotted=True):
-
-    for i, point in enumerate(points):
-        ind = i
-        if i == len(points) - 1:
-            ind = -1
-
-        second_point = points[ind + 1]
-        if not dotted:
-            pygame.draw.line(screen, (255, 255, 255), second_point.position, point.position)
-        else:
-            pygame.draw.line(screen, (100, 100, 100), second_point.position, point.position)
-            point.draw()
-def subdivide(points):
-
-    if len(points) < 3:
-        return points
-    # add the midpoints
-
-    points1 = []
-    for i, point in enumerate(points):
-        points1.append(point.copy())
-        ind = i
-        if i == len(points) - 1:
-            ind = -1
-
-        second_point = points[ind + 1]
-        middle_point_pos = (point.position + second_point.position)/2
-        middle_point = Point(position=middle_point_pos, is_control_point=False)
-        points1.append(middle_point)
-
-    for i, point in enumerate(points1):
-        if not point.is_control_point:
-            point.is_control_point = True
-            continue
-
-        ind_prev = i - 1
-        ind_next = i + 1
-        if ind_next >= len(points1):
-            ind_next = 0
-
-        point_prev = points1[ind_prev]
-        point_next = points1[ind_next]
-        point_new_pos = 0.25 * (point_prev.position + point_next.position) + 0.5 * point.position
-        point.position = point_new_pos
-        
-    return points1
-
-control_points = []
+point_radius = 5
+point_color = (255, 255, 255)
+active_color = (255, 255, 0)
+
+def create_marker(color):
+    # the control point circle is rendered once and blitted for every point
+    marker = pygame.Surface((2*point_radius + 1, 2*point_radius + 1))
+    marker.set_colorkey((0, 0, 0))
+    pygame.draw.circle(marker, color, (point_radius, point_radius), point_radius)
+    return marker.convert()
+
+class ControlPoints:
+    """
+    The control points live in the (N, 2) first level of the SubdivisionCurve, a spatial hash
+    of their indices makes picking independent of the number of points.
+    """
+
+    def __init__(self, curve):
+        self.curve = curve
+        self.grid = SpatialHash(cell_size=4*point_radius)
+
+    @property
+    def positions(self):
+        return self.curve.control_points
+
+    def __len__(self):
+        return len(self.positions)
+
+    def load(self, positions):
+        # replace all points at once, e.g. a large curve
+        self.curve.set_points(positions)
+        self.grid.build(self.positions)
+
+    def add(self, position):
+        self.curve.set_points(np.concatenate((self.positions, [position])))
+        self.grid.insert(len(self) - 1, *position)
+
+    def pop(self):
+        self.grid.remove(len(self) - 1)
+        self.curve.set_points(self.positions[:-1])
+
+    def move(self, index, position):
+        if tuple(self.positions[index].tolist()) != tuple(position):
+            self.curve.move_point(index, position)
+            self.grid.move(index, *position)
+
+    def pick(self, position):
+        # the point under position, the last one added wins like before, None if there is none
+        candidates = self.grid.query(position[0], position[1], point_radius)
+        if not candidates:
+            return None
+        candidates = np.array(candidates)
+        diff = self.positions[candidates] - position
+        inside = candidates[(diff*diff).sum(axis=1) <= point_radius**2]
+        return int(inside.max()) if len(inside) else None
+
+def draw_polygon(points, color):
+    # one call for the whole closed polyline, runs of points on the same pixel are merged first
+    pixels = np.rint(points).astype(np.int64)
+    keep = (pixels != np.roll(pixels, 1, axis=0)).any(axis=1)
+    pixels = pixels[keep] if keep.any() else pixels[:1]
+    if len(pixels) >= 2:
+        pygame.draw.lines(screen, color, True, pixels.tolist())
+
+def draw_markers(points, marker):
+    # one blit per distinct pixel on the screen, with large curves most markers overlap
+    pixels = np.rint(points).astype(np.int64) - point_radius
+    width, height = screen.get_size()
+    visible = (pixels[:, 0] > -2*point_radius) & (pixels[:, 0] < width) & (pixels[:, 1] > -2*point_radius) & (pixels[:, 1] < height)
+    pixels = pixels[visible] + 2*point_radius
+    # unique on a single int key, np.unique(axis=0) is much slower
+    rows = height + 2*point_radius
+    x, y = np.divmod(np.unique(pixels[:, 0]*rows + pixels[:, 1]), rows)
+    pixels = np.stack((x, y), axis=1) - 2*point_radius
+    screen.blits([(marker, pos) for pos in pixels.tolist()], False)
+
 active_point = None
 clock = pygame.time.Clock()
 
 num_subdivs = 1
+# every subdivision level is cached, dragging a point only updates the part of the curve around it
+curve = SubdivisionCurve(levels=num_subdivs)
+control_points = ControlPoints(curve)
+marker = create_marker(point_color)
+active_marker = create_marker(active_color)
 
 while True:
 
@@ -114,26 +119,32 @@ while True:
                 active_point = None
             if event.button == 3:
                 if active_point is None:
-                    control_points.append(Point(position=pygame.mouse.get_pos()))
+                    control_points.add(pygame.mouse.get_pos())
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_LEFT:
                 num_subdivs -= 1
             elif event.key == pygame.K_RIGHT:
                 num_subdivs += 1
             elif event.key == pygame.K_RETURN:
-                if control_points:
+                if len(control_points):
+                    if active_point == len(control_points) - 1:
+                        active_point = None
                     control_points.pop()
 
-    for point in control_points:
-        point.update()
+    if active_point is not None:
+        mouse_x, mouse_y = pygame.mouse.get_pos()
+        control_points.move(active_point, (mouse_x - 10, mouse_y - 10))
+    elif pygame.mouse.get_pressed()[0]:
+        active_point = control_points.pick(pygame.mouse.get_pos())
 
     if num_subdivs <= 0:
         num_subdivs = 1
-    sub_points = subdivide(control_points)
-    for i in range(num_subdivs - 1):
-        sub_points = subdivide(sub_points)
+    curve.set_levels(num_subdivs)
 
-    draw_dotted_polygon(control_points)
-    draw_dotted_polygon(sub_points, dotted=False)
+    draw_polygon(control_points.positions, (100, 100, 100))
+    draw_markers(control_points.positions, marker)
+    if active_point is not None:
+        draw_markers(control_points.positions[active_point:active_point + 1], active_marker)
+    draw_polygon(curve.curve, (255, 255, 255))
     pygame.display.update()
     # clock.tick(1)
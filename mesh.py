@@ -0,0 +1,78 @@
+"""
+Triangle mesh with normals precomputed at load time
+
+The object space face and vertex normals are computed once, every frame they are only
+rotated into world space with the model matrix instead of being rebuilt from the
+transformed vertices. Code that edits the vertices in place calls update(), which rebuilds
+them and bumps version, the renderer's caches compare the version to notice the edit.
+"""
+import numpy as np
+
+from transform import normal_matrix, normal_matrices, transform_points_batch
+
+
+class Mesh:
+
+    def __init__(self, vertices, indices):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        indices = np.asarray(indices, dtype=np.int64).ravel()
+        self.indices = indices[:len(indices) - len(indices) % 3].reshape(-1, 3)
+        self.version = -1
+        self.update()
+
+    def update(self, vertices=None):
+        """Recompute the normals and bounds after the vertices changed (or replace them)."""
+        if vertices is not None:
+            self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        self.version += 1
+        self.face_normals = compute_face_normals(self.vertices, self.indices)
+        self.vertex_normals = compute_vertex_normals(self.vertices, self.indices)
+        # object space bounding sphere
+        if len(self.vertices):
+            self.center = (self.vertices.min(axis=0) + self.vertices.max(axis=0)) / 2
+            self.radius = np.sqrt(((self.vertices - self.center)**2).sum(axis=1).max())
+        else:
+            self.center = np.zeros(3)
+            self.radius = 0.0
+
+    def world_normals(self, faces, model, shading="flat"):
+        """
+        World space normals of the given faces for the model matrix, (T, 3) face normals for
+        flat shading or (T, 3, 3) corner normals for gouraud shading. Not normalized.
+        """
+        mat = normal_matrix(model).T
+        if shading == "gouraud":
+            # rotate every vertex normal once, then gather them per corner
+            return (self.vertex_normals @ mat)[self.indices[faces]]
+        return self.face_normals[faces] @ mat
+
+    def instance_normals(self, instances, faces, models, shading="flat"):
+        """
+        world_normals for many copies of the mesh, models is a (K, 4, 4) stack of model
+        matrices and triangle i is face faces[i] of copy instances[i].
+        """
+        # only the copies that still have triangles are rotated
+        used, copies = np.unique(instances, return_inverse=True)
+        mats = normal_matrices(models[used])
+        if shading == "gouraud":
+            return transform_points_batch(mats, self.vertex_normals)[copies[:, None], self.indices[faces]]
+        return transform_points_batch(mats, self.face_normals)[copies, faces]
+
+def compute_face_normals(verts, inds):
+    # same winding as software_renderer: cross(v3 - v2, v1 - v2), unit length (zero for degenerate faces)
+    v1, v2, v3 = verts[inds[:, 0]], verts[inds[:, 1]], verts[inds[:, 2]]
+    normals = np.cross(v3 - v2, v1 - v2)
+    lengths = np.sqrt((normals*normals).sum(axis=1))
+    return normals / np.where(lengths > 0, lengths, 1)[:, None]
+
+def compute_vertex_normals(verts, inds):
+    # area weighted average of the normals of the faces around every vertex
+    v1, v2, v3 = verts[inds[:, 0]], verts[inds[:, 1]], verts[inds[:, 2]]
+    face_normals = np.cross(v3 - v2, v1 - v2)
+    normals = np.zeros_like(verts)
+    corners = inds.ravel()
+    weights = np.repeat(face_normals, 3, axis=0)
+    for axis in range(3):
+        normals[:, axis] = np.bincount(corners, weights=weights[:, axis], minlength=len(verts))
+    lengths = np.sqrt((normals*normals).sum(axis=1))
+    return normals / np.where(lengths > 0, lengths, 1)[:, None]
@@ -0,0 +1,119 @@
+"""
+Binary sidecar cache for meshes loaded from .obj files
+
+The first time a mesh is loaded the parsed vertices and indices are written next to the
+.obj file as <name>.obj.meshcache (float32 vertices, int32 indices and the size, mtime and
+sha1 of the source). Later loads memory-map the sidecar straight into NumPy arrays.
+The cache is thrown away and rebuilt as soon as the .obj file changes.
+"""
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+
+CACHE_SUFFIX = ".meshcache"
+MAGIC = b"MESHCACHE"
+VERSION = 1
+
+# magic, version, source size, source mtime (ns), source sha1, number of vertices, number of triangles
+HEADER = struct.Struct("<9sIqq20sqq")
+# keep the arrays aligned for the memory map
+HEADER_SIZE = 128
+
+
+def cache_path(filename):
+    return filename + CACHE_SUFFIX
+
+def file_hash(filename):
+    sha = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+    return sha.digest()
+
+def read_header(path):
+    try:
+        with open(path, "rb") as file:
+            data = file.read(HEADER.size)
+    except OSError:
+        return None
+    if len(data) != HEADER.size:
+        return None
+    header = HEADER.unpack(data)
+    if header[0] != MAGIC or header[1] != VERSION:
+        return None
+    return header
+
+def is_valid(filename, header):
+    stat = os.stat(filename)
+    _, _, size, mtime, sha, _, _ = header
+    if size != stat.st_size:
+        return False
+    if mtime == stat.st_mtime_ns:
+        return True
+    # the file was touched, only rebuild if its contents really changed
+    if sha != file_hash(filename):
+        return False
+    try:
+        # remember the new mtime so the next load doesn't hash the file again
+        with open(cache_path(filename), "r+b") as file:
+            file.write(HEADER.pack(*header[:3], stat.st_mtime_ns, *header[4:]))
+    except OSError:
+        pass
+    return True
+
+def write_cache(filename, verts, inds):
+    verts = np.ascontiguousarray(verts, dtype="<f4").reshape(-1, 3)
+    inds = np.ascontiguousarray(inds, dtype="<i4").reshape(-1, 3)
+    stat = os.stat(filename)
+    header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            stat.st_size,
+            stat.st_mtime_ns,
+            file_hash(filename),
+            len(verts),
+            len(inds),
+    )
+
+    path = cache_path(filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(header.ljust(HEADER_SIZE, b"\0"))
+        file.write(verts.tobytes())
+        file.write(inds.tobytes())
+    # never leave a half written cache behind
+    os.replace(tmp_path, path)
+
+def map_cache(path, header):
+    n_verts, n_tris = header[5], header[6]
+    verts = np.memmap(path, dtype="<f4", mode="r", offset=HEADER_SIZE, shape=(n_verts, 3)) if n_verts else np.empty((0, 3), np.float32)
+    inds_offset = HEADER_SIZE + n_verts*3*4
+    inds = np.memmap(path, dtype="<i4", mode="r", offset=inds_offset, shape=(n_tris, 3)) if n_tris else np.empty((0, 3), np.int32)
+    return (verts, inds)
+
+def load_mesh(filename, loader):
+    """
+    Load filename through the cache, loader is called to parse the .obj file on a cache miss
+    and must return (vertices, indices) like read_obj does.
+    Returns ((N, 3) float32, (M, 3) int32) arrays, or (None, None) if the mesh could not be loaded.
+    """
+    if not os.path.exists(filename):
+        return loader(filename)
+
+    path = cache_path(filename)
+    header = read_header(path)
+    if header is not None and is_valid(filename, header):
+        return map_cache(path, header)
+
+    verts, inds = loader(filename)
+    if verts is None or inds is None:
+        return (verts, inds)
+    try:
+        write_cache(filename, verts, inds)
+    except OSError:
+        # read only directory, etc. the mesh is still usable without the cache
+        return (np.asarray(verts, dtype=np.float32).reshape(-1, 3), np.asarray(inds, dtype=np.int32).reshape(-1, 3))
+    return map_cache(path, read_header(path))
@@ -0,0 +1,109 @@
+"""
+OBJ export that never stalls the frame loop
+
+The vertices and faces are formatted a block of rows at a time with a single %-format per
+block (no per value string concatenation) and written by a background thread. The job
+reports its progress and can write plain .obj, gzip compressed .obj or a binary .npz.
+Given a transform.Transform, its model matrix is baked into the exported vertices.
+"""
+import gzip
+import os
+import threading
+
+import numpy as np
+
+from transform import transform_points
+
+
+CHUNK_ROWS = 1 << 14
+
+
+def iter_obj_chunks(verts, inds, chunk_rows=CHUNK_ROWS):
+    """Yield the .obj text in pieces of at most chunk_rows lines."""
+    verts = np.asarray(verts, dtype=float).reshape(-1, 3)
+    inds = np.asarray(inds, dtype=np.int64).reshape(-1, 3)
+    for start in range(0, len(verts), chunk_rows):
+        block = verts[start:start + chunk_rows]
+        # tolist() gives python floats, %r formats them with the shortest exact representation
+        yield ("v %r %r %r\n"*len(block)) % tuple(block.ravel().tolist())
+    for start in range(0, len(inds), chunk_rows):
+        block = inds[start:start + chunk_rows] + 1
+        yield ("f %d %d %d\n"*len(block)) % tuple(block.ravel().tolist())
+
+def bake_transform(verts, transform=None):
+    verts = np.asarray(verts, dtype=float).reshape(-1, 3)
+    if transform is None:
+        return verts
+    return transform_points(transform.get_model_matrix(), verts)
+
+def format_obj(verts, inds, transform=None):
+    return "".join(iter_obj_chunks(bake_transform(verts, transform), inds))
+
+def write_obj(filename, verts, inds, fmt="obj", progress=None):
+    """
+    Write the mesh to filename, fmt is "obj", "gzip" (gzip compressed .obj) or "binary"
+    (.npz with float32 vertices and int32 indices). progress is called with values in [0, 1].
+    The file is written next to the target first and moved over it when complete.
+    """
+    verts = np.asarray(verts, dtype=float).reshape(-1, 3)
+    inds = np.asarray(inds, dtype=np.int64).reshape(-1, 3)
+    tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if fmt == "binary":
+            with open(tmp_filename, "wb") as file:
+                np.savez(file, vertices=verts.astype(np.float32), indices=inds.astype(np.int32))
+        else:
+            n_chunks = max(-(-len(verts)//CHUNK_ROWS) + -(-len(inds)//CHUNK_ROWS), 1)
+            if fmt == "gzip":
+                # the default level 9 is several times slower for a few percent smaller files
+                file = gzip.open(tmp_filename, "wt", compresslevel=6)
+            else:
+                file = open(tmp_filename, "w")
+            with file:
+                for i, chunk in enumerate(iter_obj_chunks(verts, inds)):
+                    file.write(chunk)
+                    if progress is not None:
+                        progress((i + 1) / n_chunks)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    if progress is not None:
+        progress(1.0)
+
+class ExportJob:
+
+    def __init__(self, filename, verts, inds, fmt="obj", transform=None):
+        self.filename = filename
+        self.fmt = fmt
+        self.progress = 0.0
+        self.error = None
+        # snapshot the mesh, the caller is free to change its arrays (and the transform) while we write
+        self.verts = np.array(bake_transform(verts, transform))
+        self.inds = np.array(inds, dtype=np.int64).reshape(-1, 3)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        try:
+            write_obj(self.filename, self.verts, self.inds, self.fmt, self.set_progress)
+        except Exception as e:
+            self.error = e
+
+    def set_progress(self, progress):
+        self.progress = progress
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+        return self.done()
+
+def export_obj(filename, verts, inds, fmt="obj", transform=None):
+    """Start writing the mesh (with the transform baked in) in a background thread and return its ExportJob."""
+    return ExportJob(filename, verts, inds, fmt, transform).start()
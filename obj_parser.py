@@ -0,0 +1,343 @@
+"""
+Streaming Wavefront .obj parser
+
+The file is read in fixed size chunks and every chunk is classified and converted with a
+handful of NumPy operations (no per token float()/int() calls), so memory stays bounded
+by the chunk size no matter how big the file is. Files of a few kilobytes are split into
+lines with str.split instead, the numbers of each kind are still converted together.
+
+Supports v, vt, vn and f lines, v, v/vt, v//vn and v/vt/vn face corners, negative
+(relative) indices and n-gons, which are triangulated with a fan. Lines may be indented and
+end with a # comment.
+"""
+import os
+
+import numpy as np
+
+
+CHUNK_SIZE = 1 << 22
+# smaller files are parsed line by line, the whole chunk passes cost more than they save there
+SMALL_FILE = 1 << 12
+
+SPACE, TAB, CR, LF, SLASH, HASH = (ord(c) for c in " \t\r\n/#")
+# line kinds
+V, VT, VN, F = 1, 2, 3, 4
+TAGS = {"v": V, "vt": VT, "vn": VN, "f": F}
+
+
+class ObjMesh:
+
+    def __init__(self, vertices, indices, normals=None, uvs=None, normal_indices=None, uv_indices=None):
+        self.vertices = vertices # (N, 3) float
+        self.indices = indices # (M, 3) int32, zero based
+        self.normals = normals # (K, 3) float
+        self.uvs = uvs # (L, 2) float
+        self.normal_indices = normal_indices # (M, 3) int32 into normals, None if the faces have no normals
+        self.uv_indices = uv_indices # (M, 3) int32 into uvs, None if the faces have no uvs
+
+def empty_mesh():
+    return ObjMesh(
+            np.empty((0, 3)),
+            np.empty((0, 3), dtype=np.int32),
+            np.empty((0, 3)),
+            np.empty((0, 2)),
+    )
+
+def parse_numbers(buf, dtype=float):
+    # the whole selection is converted by a single C call
+    if not len(buf):
+        return np.empty(0, dtype=dtype)
+    return np.fromstring(buf.tobytes().decode("ascii"), dtype=dtype, sep=" ")
+
+def first_columns(values, counts, n):
+    # every line may hold more than n values (w, vertex colors, ...), keep the first n
+    if not len(counts):
+        return np.empty((0, n))
+    if (counts == n).all():
+        return values.reshape(-1, n)
+    if (counts < n).any():
+        raise ValueError(f"obj: expected at least {n} values per line")
+    starts = np.cumsum(counts) - counts
+    return values[starts[:, None] + np.arange(n)]
+
+class ChunkParser:
+
+    def __init__(self):
+        # number of v, vt and vn entries seen so far, needed for negative indices
+        self.n_vertices = 0
+        self.n_uvs = 0
+        self.n_normals = 0
+        # a file uses one face format, remember it once the first face was seen
+        self.has_uvs = None
+        self.has_normals = None
+
+    def parse(self, chunk):
+        """Parse a chunk of complete lines (bytes ending with a newline) into an ObjMesh."""
+        buf = np.frombuffer(chunk, dtype=np.uint8)
+        is_lf = buf == LF
+        line_ends = np.flatnonzero(is_lf)
+        line_starts = np.empty_like(line_ends)
+        line_starts[0] = 0
+        line_starts[1:] = line_ends[:-1] + 1
+        line_lengths = line_ends - line_starts + 1
+
+        # comments run from # to the end of the line
+        text = buf.copy()
+        if b"#" in chunk:
+            hashes = np.flatnonzero(buf == HASH)
+            counts = line_ends[np.searchsorted(line_ends, hashes)] - hashes
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            text[np.repeat(hashes, counts) + offsets] = SPACE
+
+        # count the whitespace separated tokens of every line
+        is_ws = (text == SPACE) | (text == TAB) | (text == CR) | is_lf
+        token_start = ~is_ws
+        token_start[1:] &= is_ws[:-1]
+        # a sentinel token after the chunk keeps the first token lookup in bounds
+        token_positions = np.append(np.flatnonzero(token_start), len(buf))
+        first_token = np.searchsorted(token_positions, line_starts)
+        tokens_per_line = np.searchsorted(token_positions, line_ends) - first_token
+
+        # classify every line by its first token, which may be indented
+        has_tokens = tokens_per_line > 0
+        tags = np.where(has_tokens, token_positions[first_token], line_ends)
+        last = len(buf) - 1
+        first = text[tags]
+        second = text[np.minimum(tags + 1, last)]
+        third = text[np.minimum(tags + 2, last)]
+        second_blank = (second == SPACE) | (second == TAB) | (second == CR) | (second == LF)
+        third_blank = (third == SPACE) | (third == TAB) | (third == CR) | (third == LF)
+        is_vertex_line = has_tokens & (first == ord("v"))
+        kind = np.zeros(len(line_starts), dtype=np.uint8)
+        kind[is_vertex_line & second_blank] = V
+        kind[is_vertex_line & (second == ord("t")) & third_blank] = VT
+        kind[is_vertex_line & (second == ord("n")) & third_blank] = VN
+        kind[has_tokens & (first == ord("f")) & second_blank] = F
+
+        # blank out the line tags so only the numbers are left
+        text[tags[kind != 0]] = SPACE
+        text[tags[(kind == VT) | (kind == VN)] + 1] = SPACE
+        tokens_per_line -= kind != 0
+        byte_kind = np.repeat(kind, line_lengths)
+
+        vertices = self.parse_vectors(text, byte_kind, kind, V, tokens_per_line, 3)
+        uvs = self.parse_vectors(text, byte_kind, kind, VT, tokens_per_line, 2)
+        normals = self.parse_vectors(text, byte_kind, kind, VN, tokens_per_line, 3)
+        mesh = self.parse_faces(text, byte_kind, kind, tokens_per_line)
+        mesh.vertices = vertices
+        mesh.uvs = uvs
+        mesh.normals = normals
+
+        self.n_vertices += len(vertices)
+        self.n_uvs += len(uvs)
+        self.n_normals += len(normals)
+        return mesh
+
+    def parse_lines(self, chunk):
+        """
+        parse() one line at a time, for small files where the setup of the whole chunk passes
+        costs more than the lines themselves. The faces are still converted all at once.
+        """
+        # the tokens of every kind, converted together once all lines were read
+        tokens_of = {V: [], VT: [], VN: [], F: []}
+        widths = {V: 3, VT: 2, VN: 3}
+        line_kinds = []
+        corners_per_face = []
+        for line in chunk.decode("ascii").splitlines():
+            if "#" in line:
+                line = line[:line.index("#")]
+            tokens = line.split()
+            if not tokens:
+                continue
+            kind = TAGS.get(tokens[0])
+            if kind is None:
+                continue
+            line_kinds.append(kind)
+            if kind == F:
+                corners_per_face.append(len(tokens) - 1)
+                tokens_of[F] += tokens[1:]
+            else:
+                width = widths[kind]
+                if len(tokens) <= width:
+                    raise ValueError(f"obj: expected at least {width} values per line")
+                tokens_of[kind] += tokens[1:width + 1]
+
+        vertices, uvs, normals = (self.convert_vectors(tokens_of[kind], widths[kind]) for kind in (V, VT, VN))
+        if corners_per_face:
+            kinds = np.array(line_kinds, dtype=np.uint8)
+            line_face = np.flatnonzero(kinds == F)
+            def defined(line_kind, n_before):
+                return n_before + np.cumsum(kinds == line_kind)[line_face]
+            face_text = np.frombuffer(" ".join(tokens_of[F]).encode("ascii"), dtype=np.uint8)
+            mesh = self.build_faces(face_text, np.array(corners_per_face), defined)
+        else:
+            mesh = empty_mesh()
+        mesh.vertices = vertices
+        mesh.uvs = uvs
+        mesh.normals = normals
+
+        self.n_vertices += len(vertices)
+        self.n_uvs += len(uvs)
+        self.n_normals += len(normals)
+        return mesh
+
+    def convert_vectors(self, tokens, n):
+        if not tokens:
+            return np.empty((0, n))
+        values = np.fromstring(" ".join(tokens), dtype=float, sep=" ")
+        if len(values) != len(tokens):
+            raise ValueError("obj: malformed vertex data")
+        return values.reshape(-1, n)
+
+    def parse_vectors(self, text, byte_kind, kind, line_kind, tokens_per_line, n):
+        is_kind = kind == line_kind
+        if not is_kind.any():
+            return np.empty((0, n))
+        values = parse_numbers(text[byte_kind == line_kind])
+        counts = tokens_per_line[is_kind]
+        if len(values) != counts.sum():
+            raise ValueError("obj: malformed vertex data")
+        return first_columns(values, counts, n)
+
+    def parse_faces(self, text, byte_kind, kind, tokens_per_line):
+        is_f = kind == F
+        if not is_f.any():
+            return empty_mesh()
+
+        # the number of v/vt/vn entries defined before every face, for negative indices
+        line_face = is_f.nonzero()[0]
+        def defined(line_kind, n_before):
+            return n_before + np.cumsum(kind == line_kind)[line_face]
+        return self.build_faces(text[byte_kind == F], tokens_per_line[is_f], defined)
+
+    def build_faces(self, face_text, corners_per_face, defined):
+        """
+        Convert and triangulate the corners of all faces at once. face_text holds the corners
+        (bytes, separated by whitespace), defined(kind, n_before) returns the number of entries
+        of that kind defined before every face.
+        """
+        mesh = empty_mesh()
+        if (corners_per_face < 3).any():
+            raise ValueError("obj: a face needs at least 3 vertices")
+        n_corners = corners_per_face.sum()
+
+        # v, v/vt, v//vn or v/vt/vn
+        n_slashes = np.count_nonzero(face_text == SLASH)
+        if n_slashes:
+            double = np.count_nonzero((face_text[1:] == SLASH) & (face_text[:-1] == SLASH))
+            face_text = face_text.copy()
+            face_text[face_text == SLASH] = SPACE
+        else:
+            double = 0
+        values = parse_numbers(face_text, dtype=np.int64)
+
+        if n_slashes == 0:
+            has_uvs, has_normals = False, False
+        elif double == n_corners and n_slashes == 2*n_corners:
+            has_uvs, has_normals = False, True
+        elif double == 0 and n_slashes == n_corners:
+            has_uvs, has_normals = True, False
+        elif double == 0 and n_slashes == 2*n_corners:
+            has_uvs, has_normals = True, True
+        else:
+            raise ValueError("obj: faces mix different vertex formats")
+        if self.has_uvs is None:
+            self.has_uvs, self.has_normals = has_uvs, has_normals
+        elif (self.has_uvs, self.has_normals) != (has_uvs, has_normals):
+            raise ValueError("obj: faces mix different vertex formats")
+
+        n_fields = 1 + has_uvs + has_normals
+        if len(values) != n_corners*n_fields:
+            raise ValueError("obj: malformed face data")
+        values = values.reshape(-1, n_fields)
+
+        def resolve(column, line_kind, n_before):
+            ind = values[:, column]
+            if (ind == 0).any():
+                raise ValueError("obj: face indices start at 1")
+            negative = ind < 0
+            if negative.any():
+                before = np.repeat(defined(line_kind, n_before), corners_per_face)
+                ind = np.where(negative, before + ind, ind - 1)
+            else:
+                ind = ind - 1
+            return ind.astype(np.int32)
+
+        corner_vertex = resolve(0, V, self.n_vertices)
+        corner_uv = resolve(1, VT, self.n_uvs) if has_uvs else None
+        corner_normal = resolve(n_fields - 1, VN, self.n_normals) if has_normals else None
+
+        if n_corners == 3*len(corners_per_face):
+            # only triangles, the corners already are the triangles
+            mesh.indices = corner_vertex.reshape(-1, 3)
+            if corner_uv is not None:
+                mesh.uv_indices = corner_uv.reshape(-1, 3)
+            if corner_normal is not None:
+                mesh.normal_indices = corner_normal.reshape(-1, 3)
+            return mesh
+
+        # fan triangulation: (0, j, j + 1) for j in 1..n-2
+        tris_per_face = corners_per_face - 2
+        face_offset = np.cumsum(corners_per_face) - corners_per_face
+        tri_face = np.repeat(np.arange(len(corners_per_face)), tris_per_face)
+        tri_first = np.cumsum(tris_per_face) - tris_per_face
+        j = np.arange(len(tri_face)) - tri_first[tri_face] + 1
+        base = face_offset[tri_face]
+        corners = np.stack((base, base + j, base + j + 1), axis=1)
+
+        mesh.indices = corner_vertex[corners]
+        if corner_uv is not None:
+            mesh.uv_indices = corner_uv[corners]
+        if corner_normal is not None:
+            mesh.normal_indices = corner_normal[corners]
+        return mesh
+
+def parse_obj(filename, chunk_size=CHUNK_SIZE):
+    """
+    Yield an ObjMesh per chunk of the file. Indices are absolute (into the whole file),
+    only the vertices/uvs/normals defined in the chunk are included.
+    """
+    parser = ChunkParser()
+    leftover = b""
+    with open(filename, "rb") as file:
+        if os.fstat(file.fileno()).st_size < SMALL_FILE:
+            data = file.read()
+            if data.strip():
+                yield parser.parse_lines(data)
+            return
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                break
+            data = leftover + data
+            cut = data.rfind(b"\n") + 1
+            if not cut:
+                leftover = data
+                continue
+            leftover = data[cut:]
+            yield parser.parse(data[:cut])
+    if leftover.strip():
+        yield parser.parse(leftover + b"\n")
+
+def load_obj(filename, chunk_size=CHUNK_SIZE):
+    """Parse the whole file into a single ObjMesh."""
+    chunks = list(parse_obj(filename, chunk_size))
+    if not chunks:
+        return empty_mesh()
+    if len(chunks) == 1:
+        return chunks[0]
+
+    def join(name, width, dtype=float):
+        parts = [getattr(chunk, name) for chunk in chunks if getattr(chunk, name) is not None]
+        if not parts:
+            return None
+        return np.concatenate(parts).reshape(-1, width).astype(dtype, copy=False)
+
+    return ObjMesh(
+            join("vertices", 3),
+            join("indices", 3, np.int32),
+            join("normals", 3),
+            join("uvs", 2),
+            join("normal_indices", 3, np.int32),
+            join("uv_indices", 3, np.int32),
+    )
@@ -1,66 +1,197 @@
+"""
+How to use
+
+hold the left mouse button to move the first attractor to the cursor
+right click to add another attractor
+
+Pass --orbiters N to simulate N orbiters (default 20000)
+Pass --mutual to let the orbiters attract each other too (Barnes-Hut, --theta sets the opening
+angle, default 0.5), on one core about 500 orbiters still run in real time, a thousand at
+roughly half speed (--headless measures it)
+Pass --headless SECONDS to simulate that many seconds without a window and print the speed
+Pass --record FILE to record every step of the run (live or headless) into FILE
+
+Pass --replay FILE to play a recorded run back (--speed S, default 1, negative plays backwards)
+space pauses, left and right arrows seek a second, up and down arrows double and halve the speed
+"""
 import pygame
 import sys
+import time
 
+import numpy as np
 
-SCREEN_WIDTH, SCREEN_HEIGHT = (800, 600)
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Orbiter")
-
-# the coords for the object to orbit around
-center = pygame.math.Vector2(SCREEN_WIDTH//2, SCREEN_HEIGHT//2)
-
-# the orbiter's coords
-orbiter = pygame.math.Vector2(200, 200)
-
-# the orbiter's speed
-speed = 200
-
-# the orbiter's basis
-right = pygame.math.Vector2(1, 0)
-up = pygame.math.Vector2(0, 1)
-
-# delta time
-clock = pygame.time.Clock()
-delta = 0
-
-# mainloop
-while True:
-
-    screen.fill((0, 0, 0))
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
+from barnes_hut import BarnesHut
+from simulation import Simulation, circular_orbits
+from trajectory import TrajectoryRecorder, TrajectoryReplay
 
-    # follow the cursor when the left mouse button is clicked
-    if pygame.mouse.get_pressed()[0]:
-        x_c, y_c = pygame.mouse.get_pos()
-        center = pygame.math.Vector2(x_c, y_c)
-
-    # move a little bit in the x
-    move = speed * delta * right
-    orbiter += move
-
-    # point the up vector to the center
-    up = (center - orbiter).normalize()
-
-    # recalculate our right vector
-    right = pygame.math.Vector2(-up.y, up.x)
-
-    # draw the center and the orbiter
-    pygame.draw.circle(screen, (255, 0, 0), center, 10)
-    pygame.draw.circle(screen, (0, 255, 0), orbiter, 10)
-
-    # draw the basis for visualing
-    pygame.draw.line(screen, (255, 0, 0), orbiter, orbiter + 20*right)
-    pygame.draw.line(screen, (0, 0, 255), orbiter, orbiter + 20*up)
-
-    # update the screen
-    pygame.display.update()
-    clock.tick()
-
-    fps = clock.get_fps()
-    if fps:
-        delta = 1.0/fps
 
+SCREEN_WIDTH, SCREEN_HEIGHT = (800, 600)
+# with --mutual all orbiters together weigh this much of an attractor
+orbiters_mass = 0.2
+
+# with a few orbiters each one is drawn with its basis like the single orbiter used to be
+max_drawn_bases = 50
+
+def draw_orbiters(screen, positions, color):
+    # one pixel per orbiter, written straight into the surface
+    pixels = np.floor(positions).astype(np.int64)
+    width, height = screen.get_size()
+    inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < height)
+    pixels = pixels[inside]
+    surface_pixels = pygame.surfarray.pixels2d(screen)
+    surface_pixels[pixels[:, 0], pixels[:, 1]] = screen.map_rgb(color)
+    del surface_pixels
+
+def draw(screen, attractors, positions):
+    """Draws a frame of the attractors and the orbiters at positions, live or replayed."""
+    for attractor in attractors.tolist():
+        pygame.draw.circle(screen, (255, 0, 0), attractor, 10)
+    if len(positions) > max_drawn_bases:
+        draw_orbiters(screen, positions, (0, 255, 0))
+        return
+    center = pygame.math.Vector2(attractors[0].tolist())
+    for position in positions.tolist():
+        orbiter = pygame.math.Vector2(position)
+        pygame.draw.circle(screen, (0, 255, 0), orbiter, 10)
+        if orbiter == center:
+            continue
+        # the orbiter's basis: up points to the center, right is perpendicular to it
+        up = (center - orbiter).normalize()
+        right = pygame.math.Vector2(-up.y, up.x)
+        pygame.draw.line(screen, (255, 0, 0), orbiter, orbiter + 20*right)
+        pygame.draw.line(screen, (0, 0, 255), orbiter, orbiter + 20*up)
+
+def option(name, convert, default=None):
+    # the value following name on the command line, default if name wasn't passed
+    if name not in sys.argv:
+        return default
+    try:
+        value = sys.argv[sys.argv.index(name) + 1]
+        # the next flag is no file name (a negative --speed starts with a single -)
+        if value.startswith("--"):
+            raise ValueError(value)
+        return convert(value)
+    except (IndexError, ValueError):
+        sys.exit(f"{name} needs a value\n{__doc__}")
+
+def create_simulation(n_orbiters, mutual=False, theta=0.5):
+    center = (SCREEN_WIDTH//2, SCREEN_HEIGHT//2)
+    positions, velocities = circular_orbits(n_orbiters, center)
+    simulation = Simulation(positions, velocities, [center])
+    if mutual:
+        strength = simulation.strengths[0] * orbiters_mass / max(n_orbiters, 1)
+        simulation.forces.append(BarnesHut(strength, theta, simulation.softening))
+    return simulation
+
+def run_headless(simulation, seconds):
+    steps = int(round(seconds / simulation.dt))
+    start = time.perf_counter()
+    simulation.run(steps)
+    elapsed = time.perf_counter() - start
+    print(f"{len(simulation.positions)} orbiters, {steps} steps of {simulation.dt:.4f}s in {elapsed:.2f}s "
+          f"({steps/elapsed:.0f} steps/s, {seconds/elapsed:.1f}x real time)")
+
+def run_replay(screen, replay, speed=1.0):
+    clock = pygame.time.Clock()
+    playback_time = 0.0
+    paused = False
+    while True:
+
+        screen.fill((0, 0, 0))
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_LEFT:
+                    playback_time -= 1
+                elif event.key == pygame.K_RIGHT:
+                    playback_time += 1
+                elif event.key == pygame.K_UP:
+                    speed *= 2
+                elif event.key == pygame.K_DOWN:
+                    speed /= 2
+
+        # the file may still be growing if the run is being recorded
+        replay.refresh()
+        frame_time = clock.tick() / 1000
+        if not paused:
+            playback_time += speed*frame_time
+        # loop around at both ends
+        if replay.duration > 0:
+            playback_time %= replay.duration
+        else:
+            playback_time = 0.0
+
+        if len(replay):
+            positions, attractors = replay.at(playback_time)
+            draw(screen, attractors, positions)
+
+        pygame.display.update()
+        pygame.display.set_caption(f"Orbiter replay - {playback_time:.2f}s / {replay.duration:.2f}s, "
+                                   f"speed {speed:g}{' (paused)' if paused else ''}, {clock.get_fps():.0f} fps")
+
+def main():
+    replay_filename = option("--replay", str)
+    if replay_filename is not None:
+        replay = TrajectoryReplay(replay_filename)
+        speed = option("--speed", float, 1.0)
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        run_replay(screen, replay, speed)
+
+    n_orbiters = option("--orbiters", int, 20000)
+    headless = option("--headless", float)
+    record_filename = option("--record", str)
+    theta = option("--theta", float, 0.5)
+    simulation = create_simulation(n_orbiters, "--mutual" in sys.argv, theta)
+    recorder = None
+    if record_filename is not None:
+        recorder = TrajectoryRecorder(record_filename, n_orbiters, simulation.dt)
+        recorder.record(simulation.positions, simulation.attractors)
+        simulation.observers.append(recorder)
+    if headless is not None:
+        run_headless(simulation, headless)
+        if recorder is not None:
+            recorder.close()
+        return
+
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Orbiter")
+    clock = pygame.time.Clock()
+
+    # mainloop
+    while True:
+
+        screen.fill((0, 0, 0))
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                if recorder is not None:
+                    recorder.close()
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:
+                simulation.set_attractors(np.concatenate((simulation.attractors, [event.pos])))
+
+        # follow the cursor when the left mouse button is clicked, moving the attractor means
+        # new accelerations (and a new tree with --mutual) so only when the cursor moved
+        mouse = pygame.mouse.get_pos()
+        if pygame.mouse.get_pressed()[0] and tuple(simulation.attractors[0].tolist()) != mouse:
+            attractors = simulation.attractors.copy()
+            attractors[0] = mouse
+            simulation.set_attractors(attractors)
+
+        # the simulation runs in fixed steps whatever the frame rate, drawing is interpolated
+        simulation.advance(clock.tick() / 1000)
+        draw(screen, simulation.attractors, simulation.interpolated())
+
+        # update the screen
+        pygame.display.update()
+        pygame.display.set_caption(f"Orbiter - {n_orbiters} orbiters, {clock.get_fps():.0f} fps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Per-stage frame profiler
+
+Wrap the stages of a frame in `with profiler.stage("name"):` and add counts with
+profiler.count("name", n). While the profiler is disabled stage() hands out one shared
+no-op context manager, so the hooks can stay in the frame loop for good. When enabled every
+stage is stored in a ring buffer of the last CAPACITY events that can be dumped as JSON or
+as a Chrome trace (chrome://tracing, Perfetto), and draw_hud shows the averages of the last
+frames on top of the window.
+"""
+import collections
+import json
+import time
+
+import numpy as np
+import pygame
+
+
+CAPACITY = 1 << 16
+# frames averaged by the HUD
+HUD_FRAMES = 60
+
+
+class NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Stage:
+
+    def __init__(self, profiler, stage_id):
+        self.profiler = profiler
+        self.stage_id = stage_id
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.stage_id, self.start, time.perf_counter())
+        return False
+
+class Profiler:
+
+    def __init__(self, capacity=CAPACITY):
+        self.enabled = False
+        self.names = []
+        self.stages = {}
+        self.epoch = time.perf_counter()
+
+        # ring buffer of stage events
+        self.capacity = capacity
+        self.event_stage = np.zeros(capacity, dtype=np.int32)
+        self.event_frame = np.zeros(capacity, dtype=np.int64)
+        self.event_start = np.zeros(capacity)
+        self.event_duration = np.zeros(capacity)
+        self.n_events = 0
+
+        self.frame = 0
+        self.frame_start = None
+        self.frame_times = {}
+        self.counters = {}
+        # (frame, start, ms per stage, counters) of the last frames
+        self.history = collections.deque(maxlen=capacity // 16)
+        self.font = None
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.frame_start = None
+        self.frame_times = {}
+        self.counters = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = Stage(self, len(self.names))
+            self.names.append(name)
+            self.stages[name] = stage
+        return stage
+
+    def record(self, stage_id, start, end):
+        i = self.n_events % self.capacity
+        self.event_stage[i] = stage_id
+        self.event_frame[i] = self.frame
+        self.event_start[i] = start - self.epoch
+        self.event_duration[i] = end - start
+        self.n_events += 1
+        name = self.names[stage_id]
+        self.frame_times[name] = self.frame_times.get(name, 0.0) + (end - start)
+
+    def count(self, name, n):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def begin_frame(self):
+        if self.enabled:
+            self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if not self.enabled or self.frame_start is None:
+            return
+        end = time.perf_counter()
+        self.frame_times["frame"] = end - self.frame_start
+        self.history.append((self.frame, self.frame_start - self.epoch, self.frame_times, self.counters))
+        self.frame += 1
+        self.frame_start = None
+        self.frame_times = {}
+        self.counters = {}
+
+    def averages(self, frames=HUD_FRAMES):
+        """Mean ms per stage and mean counts over the last frames."""
+        recent = list(self.history)[-frames:]
+        times = {}
+        counts = {}
+        for _, _, frame_times, counters in recent:
+            for name, t in frame_times.items():
+                times[name] = times.get(name, 0.0) + t
+            for name, n in counters.items():
+                counts[name] = counts.get(name, 0) + n
+        n = max(len(recent), 1)
+        return (
+            dict((name, t / n * 1000) for name, t in times.items()),
+            dict((name, c / n) for name, c in counts.items()),
+        )
+
+    def events(self):
+        # the events still in the ring buffer, oldest first
+        n = min(self.n_events, self.capacity)
+        order = (np.arange(n) + self.n_events - n) % self.capacity
+        return self.event_stage[order], self.event_frame[order], self.event_start[order], self.event_duration[order]
+
+    def to_json(self):
+        stages, frames, starts, durations = self.events()
+        return {
+            "stages": list(self.names),
+            "events": [
+                {"stage": self.names[s], "frame": f, "start_ms": t*1000, "ms": d*1000}
+                for s, f, t, d in zip(stages.tolist(), frames.tolist(), starts.tolist(), durations.tolist())
+            ],
+            "frames": [
+                {"frame": f, "start_ms": t*1000, "ms": dict((name, v*1000) for name, v in times.items()), "counters": counters}
+                for f, t, times, counters in self.history
+            ],
+        }
+
+    def to_chrome_trace(self):
+        # complete ("X") events for the stages and counter ("C") events per frame, times in us
+        stages, frames, starts, durations = self.events()
+        events = [
+            {"name": self.names[s], "ph": "X", "ts": t*1e6, "dur": d*1e6, "pid": 0, "tid": 0, "args": {"frame": f}}
+            for s, f, t, d in zip(stages.tolist(), frames.tolist(), starts.tolist(), durations.tolist())
+        ]
+        for f, t, times, counters in self.history:
+            events.append({"name": "frame", "ph": "X", "ts": t*1e6, "dur": times["frame"]*1e6, "pid": 0, "tid": 1, "args": {"frame": f}})
+            if counters:
+                events.append({"name": "triangles", "ph": "C", "ts": t*1e6, "pid": 0, "args": counters})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, filename, fmt="chrome"):
+        """Write the recorded frames to filename, fmt is "chrome" (trace event format) or "json"."""
+        data = self.to_chrome_trace() if fmt == "chrome" else self.to_json()
+        with open(filename, "w") as file:
+            json.dump(data, file)
+
+    def draw_hud(self, surface, x=10, y=None):
+        # ms per stage and the counters, averaged over the last HUD_FRAMES frames
+        # returns the rectangle drawn to (None if there is nothing to show yet)
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, 18)
+        times, counts = self.averages()
+        lines = [f"{name:<12}{ms:7.2f} ms" for name, ms in sorted(times.items(), key=lambda item: -item[1])]
+        lines += [f"{name:<12}{n:9.0f}" for name, n in sorted(counts.items())]
+        if not lines:
+            return None
+        line_height = self.font.get_linesize()
+        width = max(self.font.size(line)[0] for line in lines) + 10
+        height = line_height*len(lines) + 10
+        if y is None:
+            y = surface.get_height() - height - 10
+        panel = pygame.Surface((width, height), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 160))
+        for i, line in enumerate(lines):
+            panel.blit(self.font.render(line, True, (255, 255, 255)), (5, 5 + i*line_height))
+        return surface.blit(panel, (x, y))
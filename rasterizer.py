@@ -0,0 +1,132 @@
+"""
+Z-buffered triangle rasterizer written with NumPy
+
+Triangles are evaluated with edge functions over their bounding boxes. Instead of looping
+over the triangles, triangles of similar size are grouped and a whole group is rasterized
+at once as a (T, S, S) block of samples; the depth test is resolved by sorting the covered
+samples by pixel and depth. Colors go straight into the pixels of a pygame surface
+(pygame.surfarray), depths into a float32 buffer of the same size.
+"""
+import numpy as np
+import pygame
+
+
+# samples evaluated per batch, bounds the memory used by a single batch
+BATCH_SAMPLES = 1 << 18
+SMALLEST_TILE = 4
+# triangles with a smaller (doubled) area in square pixels are collinear and cover nothing
+MIN_AREA = 1e-6
+
+
+class DepthBuffer:
+
+    def __init__(self):
+        self.depth = None
+
+    def clear(self, size):
+        # size is the (width, height) of the surface, the buffer is indexed [x, y] like surfarray
+        if self.depth is None or self.depth.shape != tuple(size):
+            self.depth = np.empty(size, dtype=np.float32)
+        self.depth.fill(np.inf)
+
+def rasterize_tris(color_buf, depth_buf, tris, depths, colors):
+    """
+    color_buf: (W, H, 3) uint8 array, depth_buf: (W, H) float32 array
+    tris: (T, 3, 2) screen space corners, depths: (T, 3) distance of every corner to the camera
+    colors: (T, 3) flat colors or (T, 3, 3) per corner colors (interpolated)
+    """
+    width, height = depth_buf.shape
+    tris = np.asarray(tris, dtype=np.float64)
+    depths = np.asarray(depths, dtype=np.float64)
+    colors = np.asarray(colors, dtype=np.float64)
+    if not len(tris):
+        return
+
+    lo = np.floor(tris.min(axis=1)).astype(np.int64)
+    hi = np.ceil(tris.max(axis=1)).astype(np.int64)
+    lo = np.maximum(lo, 0)
+    hi = np.minimum(hi, (width - 1, height - 1))
+    extent = hi - lo + 1
+    e1 = tris[:, 1] - tris[:, 0]
+    e2 = tris[:, 2] - tris[:, 0]
+    area = e1[:, 0]*e2[:, 1] - e2[:, 0]*e1[:, 1]
+    # the edge tests divide by the area, drop the degenerate triangles before them
+    keep = (extent > 0).all(axis=1) & (np.abs(area) > MIN_AREA)
+    tris, depths, colors, lo, extent = tris[keep], depths[keep], colors[keep], lo[keep], extent[keep]
+
+    # group the triangles by the power of two tile their bounding box fits in
+    tile = np.maximum(np.ceil(np.log2(np.maximum(extent.max(axis=1), 1))).astype(np.int64), 0)
+    tile = np.maximum(1 << tile, SMALLEST_TILE)
+    for size in np.unique(tile):
+        group = np.flatnonzero(tile == size)
+        batch = max(BATCH_SAMPLES // (size*size), 1)
+        for start in range(0, len(group), batch):
+            sel = group[start:start + batch]
+            rasterize_group(color_buf, depth_buf, tris[sel], depths[sel], colors[sel], lo[sel], int(size))
+
+def rasterize_group(color_buf, depth_buf, tris, depths, colors, lo, size):
+    width, height = depth_buf.shape
+    steps = np.arange(size)
+    # pixel centers of every sample, (T, S, S) indexed [triangle, x, y]
+    px = (lo[:, 0, None, None] + steps[None, :, None]).astype(np.float64) + 0.5
+    py = (lo[:, 1, None, None] + steps[None, None, :]).astype(np.float64) + 0.5
+
+    x0, y0 = tris[:, 0, 0, None, None], tris[:, 0, 1, None, None]
+    x1, y1 = tris[:, 1, 0, None, None], tris[:, 1, 1, None, None]
+    x2, y2 = tris[:, 2, 0, None, None], tris[:, 2, 1, None, None]
+    area = (x1 - x0)*(y2 - y0) - (x2 - x0)*(y1 - y0)
+
+    # barycentric coordinates from the edge functions, the sign of area takes care of the winding
+    b0 = ((x1 - px)*(y2 - py) - (x2 - px)*(y1 - py)) / area
+    b1 = ((x2 - px)*(y0 - py) - (x0 - px)*(y2 - py)) / area
+    b2 = 1 - b0 - b1
+    inside = (b0 >= 0) & (b1 >= 0) & (b2 >= 0)
+    inside &= (px < width) & (py < height)
+    t, sx, sy = np.nonzero(inside)
+    if not len(t):
+        return
+    b0, b1, b2 = b0[t, sx, sy], b1[t, sx, sy], b2[t, sx, sy]
+
+    # 1/depth is linear in screen space
+    inv_depth = b0/depths[t, 0] + b1/depths[t, 1] + b2/depths[t, 2]
+    z = 1/inv_depth
+    x = lo[t, 0] + sx
+    y = lo[t, 1] + sy
+
+    # depth test against the buffer, then between the samples of this batch
+    closer = z < depth_buf[x, y]
+    t, x, y, z = t[closer], x[closer], y[closer], z[closer]
+    b0, b1, b2, inv_depth = b0[closer], b1[closer], b2[closer], inv_depth[closer]
+    pixel = x*height + y
+    order = np.lexsort((z, pixel))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = pixel[order[1:]] != pixel[order[:-1]]
+    win = order[first]
+
+    t, x, y = t[win], x[win], y[win]
+    depth_buf[x, y] = z[win]
+    if colors.ndim == 2:
+        color = colors[t]
+    else:
+        # perspective correct interpolation of the corner colors
+        w0 = (b0[win]/depths[t, 0] / inv_depth[win])[:, None]
+        w1 = (b1[win]/depths[t, 1] / inv_depth[win])[:, None]
+        w2 = (b2[win]/depths[t, 2] / inv_depth[win])[:, None]
+        color = w0*colors[t, 0] + w1*colors[t, 1] + w2*colors[t, 2]
+    color_buf[x, y] = np.clip(color, 0, 255).astype(np.uint8)
+
+def draw_tris_zbuffered(surface, depth_buffer, tris, depths, colors):
+    if depth_buffer.depth is None or depth_buffer.depth.shape != surface.get_size():
+        depth_buffer.clear(surface.get_size())
+    try:
+        # write straight into the surface's pixels
+        pixels = pygame.surfarray.pixels3d(surface)
+    except ValueError:
+        # pixel format without a direct view, render into a copy and blit it once
+        color_buf = pygame.surfarray.array3d(surface)
+        rasterize_tris(color_buf, depth_buffer.depth, tris, depths, colors)
+        pygame.surfarray.blit_array(surface, color_buf)
+        return
+    rasterize_tris(pixels, depth_buffer.depth, tris, depths, colors)
+    # unlock the surface
+    del pixels
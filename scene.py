@@ -0,0 +1,243 @@
+"""
+Scenes with many meshes
+
+Every object keeps a world space bounding box and sphere. The boxes are stored in a
+bounding volume hierarchy (flat arrays, median split on the longest axis) that is culled
+against the camera frustum before any per-vertex work: subtrees outside the frustum are
+skipped and subtrees completely inside are accepted without testing their children, so the
+cost follows what is visible instead of the size of the scene.
+"""
+import numpy as np
+
+from transform import Transform, transform_points
+
+
+LEAF_SIZE = 4
+
+OUTSIDE, INTERSECTING, INSIDE = 0, 1, 2
+
+
+class SceneObject:
+
+    def __init__(self, mesh, transform=None, color=(255, 255, 255), lods=None):
+        # lods: an optional decimate.LodChain of the mesh, drawn instead of it by draw_scene
+        self.mesh = mesh
+        self.lods = lods
+        self.transform = Transform() if transform is None else transform
+        self.color = color
+        self.scene = None
+        self.version = None
+
+        # object space bounds
+        verts = mesh.vertices
+        if len(verts):
+            self.local_min = verts.min(axis=0)
+            self.local_max = verts.max(axis=0)
+        else:
+            self.local_min = self.local_max = np.zeros(3)
+        self.local_center = (self.local_min + self.local_max) / 2
+        self.local_radius = np.sqrt(((verts - self.local_center)**2).sum(axis=1).max()) if len(verts) else 0.0
+        self.update_bounds()
+
+    # move the object through these so the scene knows its bounds changed
+    def set_position(self, position):
+        self.transform.set_position(position)
+        self.moved()
+
+    def set_angle(self, angle):
+        self.transform.set_angle(angle)
+        self.moved()
+
+    def set_scale(self, scale):
+        self.transform.set_scale(scale)
+        self.moved()
+
+    def moved(self):
+        if self.scene is not None:
+            self.scene.moved.add(self)
+
+    def update_bounds(self):
+        # returns True if the world space bounds changed
+        model = self.transform.get_model_matrix()
+        if self.version == self.transform.version:
+            return False
+        self.version = self.transform.version
+
+        corners = np.array([
+            [x, y, z]
+            for x in (self.local_min[0], self.local_max[0])
+            for y in (self.local_min[1], self.local_max[1])
+            for z in (self.local_min[2], self.local_max[2])
+        ])
+        corners = transform_points(model, corners)
+        self.bounds_min = corners.min(axis=0)
+        self.bounds_max = corners.max(axis=0)
+        self.center = transform_points(model, self.local_center)
+        self.radius = self.local_radius * np.sqrt((model[:3, :3]**2).sum(axis=0)).max()
+        return True
+
+class Frustum:
+
+    def __init__(self, planes):
+        # (6, 4) planes (a, b, c, d), a point p is inside when a*x + b*y + c*z + d >= 0 for all of them
+        self.planes = planes
+
+    @classmethod
+    def from_matrix(self, view_projection):
+        # Gribb/Hartmann: the planes are sums and differences of the rows of the matrix
+        r0, r1, r2, r3 = view_projection
+        planes = np.array([r3 + r0, r3 - r0, r3 + r1, r3 - r1, r3 + r2, r3 - r2])
+        lengths = np.sqrt((planes[:, :3]**2).sum(axis=1))
+        return Frustum(planes / lengths[:, None])
+
+    def classify_boxes(self, lo, hi):
+        # OUTSIDE, INTERSECTING or INSIDE for every (B, 3) box
+        normals = self.planes[:, :3]
+        d = self.planes[:, 3]
+        positive = normals >= 0
+        # the corner furthest along every plane normal and the one furthest against it
+        far = np.where(positive[None], hi[:, None], lo[:, None])
+        near = np.where(positive[None], lo[:, None], hi[:, None])
+        far_dist = (far*normals[None]).sum(axis=2) + d
+        near_dist = (near*normals[None]).sum(axis=2) + d
+        result = np.full(len(lo), INTERSECTING)
+        result[(near_dist >= 0).all(axis=1)] = INSIDE
+        result[(far_dist < 0).any(axis=1)] = OUTSIDE
+        return result
+
+    def test_spheres(self, centers, radii):
+        dist = centers @ self.planes[:, :3].T + self.planes[:, 3]
+        return (dist >= -radii[:, None]).all(axis=1)
+
+class BVH:
+
+    def __init__(self, lo, hi):
+        """lo, hi: (N, 3) bounding boxes of the objects."""
+        self.order = np.arange(len(lo))
+        self.node_lo = []
+        self.node_hi = []
+        self.left = []
+        self.right = []
+        self.start = []
+        self.count = []
+        if len(lo):
+            self.build(lo, hi, 0, len(lo))
+        self.node_lo = np.array(self.node_lo).reshape(-1, 3)
+        self.node_hi = np.array(self.node_hi).reshape(-1, 3)
+        self.left = np.array(self.left, dtype=np.int64)
+        self.right = np.array(self.right, dtype=np.int64)
+        self.start = np.array(self.start, dtype=np.int64)
+        self.count = np.array(self.count, dtype=np.int64)
+
+    def build(self, lo, hi, start, end):
+        # nodes are stored in preorder, the objects of a subtree are order[start:end]
+        node = len(self.start)
+        objects = self.order[start:end]
+        self.node_lo.append(lo[objects].min(axis=0))
+        self.node_hi.append(hi[objects].max(axis=0))
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(start)
+        self.count.append(end - start)
+        if end - start <= LEAF_SIZE:
+            return node
+
+        centers = (lo[objects] + hi[objects]) / 2
+        axis = np.argmax(centers.max(axis=0) - centers.min(axis=0))
+        mid = (end - start) // 2
+        split = np.argpartition(centers[:, axis], mid)
+        self.order[start:end] = objects[split]
+        self.left[node] = self.build(lo, hi, start, start + mid)
+        self.right[node] = self.build(lo, hi, start + mid, end)
+        return node
+
+    def refit(self, lo, hi):
+        # children come after their parent, so walking backwards visits them first
+        for node in range(len(self.start) - 1, -1, -1):
+            left = self.left[node]
+            if left < 0:
+                objects = self.order[self.start[node]:self.start[node] + self.count[node]]
+                self.node_lo[node] = lo[objects].min(axis=0)
+                self.node_hi[node] = hi[objects].max(axis=0)
+            else:
+                right = self.right[node]
+                self.node_lo[node] = np.minimum(self.node_lo[left], self.node_lo[right])
+                self.node_hi[node] = np.maximum(self.node_hi[left], self.node_hi[right])
+
+    def query(self, frustum, lo, hi):
+        """Indices of the objects whose box is not completely outside the frustum."""
+        if not len(self.start):
+            return np.empty(0, dtype=np.int64)
+        visible = []
+        nodes = np.array([0])
+        # breadth first, one level of nodes is classified per NumPy call
+        while len(nodes):
+            result = frustum.classify_boxes(self.node_lo[nodes], self.node_hi[nodes])
+            for node in nodes[result == INSIDE].tolist():
+                visible.append(self.order[self.start[node]:self.start[node] + self.count[node]])
+            crossing = nodes[result == INTERSECTING]
+            leaves = crossing[self.left[crossing] < 0]
+            if len(leaves):
+                objects = np.concatenate([self.order[self.start[node]:self.start[node] + self.count[node]] for node in leaves.tolist()])
+                keep = frustum.classify_boxes(lo[objects], hi[objects]) != OUTSIDE
+                visible.append(objects[keep])
+            inner = crossing[self.left[crossing] >= 0]
+            nodes = np.concatenate((self.left[inner], self.right[inner]))
+        return np.concatenate(visible) if visible else np.empty(0, dtype=np.int64)
+
+class Scene:
+
+    def __init__(self):
+        self.objects = []
+        self.moved = set()
+        self.bvh = None
+        self.lo = np.empty((0, 3))
+        self.hi = np.empty((0, 3))
+        self.camera_transform = Transform()
+
+    def add(self, obj):
+        obj.scene = self
+        self.objects.append(obj)
+        self.bvh = None
+        return obj
+
+    def remove(self, obj):
+        obj.scene = None
+        self.objects.remove(obj)
+        self.moved.discard(obj)
+        self.bvh = None
+
+    def update(self):
+        if self.bvh is None:
+            for obj in self.objects:
+                obj.update_bounds()
+            self.lo = np.array([obj.bounds_min for obj in self.objects]).reshape(-1, 3)
+            self.hi = np.array([obj.bounds_max for obj in self.objects]).reshape(-1, 3)
+            self.bvh = BVH(self.lo, self.hi)
+            self.index = dict((id(obj), i) for i, obj in enumerate(self.objects))
+            self.moved.clear()
+            return
+
+        changed = False
+        for obj in self.moved:
+            if obj.update_bounds():
+                i = self.index[id(obj)]
+                self.lo[i] = obj.bounds_min
+                self.hi[i] = obj.bounds_max
+                changed = True
+        self.moved.clear()
+        if changed:
+            self.bvh.refit(self.lo, self.hi)
+
+    def visible_objects(self, cam):
+        """The objects that can be seen from the camera, tested box and sphere."""
+        self.update()
+        frustum = Frustum.from_matrix(self.camera_transform.get_view_projection_matrix(cam))
+        candidates = self.bvh.query(frustum, self.lo, self.hi)
+        if not len(candidates):
+            return []
+        objects = [self.objects[i] for i in candidates.tolist()]
+        centers = np.array([obj.center for obj in objects])
+        radii = np.array([obj.radius for obj in objects])
+        keep = frustum.test_spheres(centers, radii)
+        return [obj for obj, k in zip(objects, keep.tolist()) if k]
@@ -0,0 +1,158 @@
+"""
+Fixed timestep simulation of many orbiters
+
+The orbiters are (N, 2) position and velocity arrays pulled by a few attractors (softened
+inverse square gravity), every step is a handful of whole-array operations on preallocated
+buffers. The integrator is symplectic so orbits keep their energy instead of spiralling:
+    verlet: velocity Verlet (kick, drift, kick), one force evaluation per step
+    euler:  semi-implicit Euler, velocity first, then position with the new velocity
+
+The timestep is fixed and independent of the frame rate. advance(frame_time) runs as many
+steps as fit in the time that passed and keeps the rest for the next frame, interpolated()
+blends the last two steps by that rest so the motion stays smooth at any frame rate. Nothing
+here draws, run(steps) simulates headless as fast as the arrays go.
+"""
+import math
+
+import numpy as np
+
+
+class Simulation:
+
+    def __init__(self, positions, velocities, attractors, strengths=8e6, dt=1/120,
+                 softening=10.0, integrator="verlet", max_steps=8):
+        self.positions = np.array(positions, dtype=float).reshape(-1, 2)
+        self.velocities = np.array(velocities, dtype=float).reshape(-1, 2)
+        self.attractors = np.array(attractors, dtype=float).reshape(-1, 2)
+        # G * mass of every attractor
+        self.strengths = np.broadcast_to(np.asarray(strengths, dtype=float), (len(self.attractors),)).copy()
+        self.dt = dt
+        self.softening = softening
+        self.integrator = integrator
+        # at most this many steps per advance, a slow frame slows the simulation down instead
+        # of making the next frame even slower
+        self.max_steps = max_steps
+        # extra accelerations (e.g. mutual gravity), functions of positions returning (N, 2)
+        self.forces = []
+        # called with the simulation after every step (e.g. a trajectory.TrajectoryRecorder)
+        self.observers = []
+        self.time = 0.0
+        self.steps = 0
+        self.accumulator = 0.0
+        self.previous = self.positions.copy()
+        self.allocate()
+
+    def allocate(self):
+        n = len(self.positions)
+        self.acceleration = np.zeros((n, 2))
+        self.delta = np.empty((n, 2))
+        # one buffer per component, whole-array ops on (N,) are much faster than on (N, 2) with
+        # broadcasting
+        self.offset_x = np.empty(n)
+        self.offset_y = np.empty(n)
+        self.distance = np.empty(n)
+        self.scratch = np.empty(n)
+        self.stale = True
+
+    def set_attractors(self, attractors, strengths=None):
+        """Move, add or remove attractors, without strengths the ones that stay keep theirs."""
+        attractors = np.array(attractors, dtype=float).reshape(-1, 2)
+        if strengths is None:
+            # new attractors are as strong as the first one
+            kept = min(len(attractors), len(self.strengths))
+            strengths = np.full(len(attractors), self.strengths[0] if len(self.strengths) else 8e6)
+            strengths[:kept] = self.strengths[:kept]
+        self.attractors = attractors
+        self.strengths = np.broadcast_to(np.asarray(strengths, dtype=float), (len(self.attractors),)).copy()
+        self.stale = True
+
+    def accelerations(self, positions, out):
+        """The accelerations at positions written into out, (N, 2)."""
+        out.fill(0)
+        offset_x, offset_y, distance, scratch = self.offset_x, self.offset_y, self.distance, self.scratch
+        x, y = positions[:, 0], positions[:, 1]
+        for (ax, ay), strength in zip(self.attractors.tolist(), self.strengths.tolist()):
+            # strength * offset / (|offset|^2 + softening^2)^(3/2), x**-1.5 is much slower than sqrt
+            np.subtract(ax, x, out=offset_x)
+            np.subtract(ay, y, out=offset_y)
+            np.multiply(offset_x, offset_x, out=distance)
+            np.multiply(offset_y, offset_y, out=scratch)
+            distance += scratch
+            distance += self.softening**2
+            np.sqrt(distance, out=scratch)
+            scratch *= distance
+            np.divide(strength, scratch, out=scratch)
+            offset_x *= scratch
+            offset_y *= scratch
+            out[:, 0] += offset_x
+            out[:, 1] += offset_y
+        for force in self.forces:
+            out += force(positions)
+        return out
+
+    def step(self):
+        dt = self.dt
+        positions, velocities, acceleration = self.positions, self.velocities, self.acceleration
+        delta = self.delta
+        if self.integrator == "verlet":
+            if self.stale:
+                self.accelerations(positions, acceleration)
+            velocities += np.multiply(acceleration, 0.5*dt, out=delta)
+            positions += np.multiply(velocities, dt, out=delta)
+            self.accelerations(positions, acceleration)
+            velocities += np.multiply(acceleration, 0.5*dt, out=delta)
+            self.stale = False
+        elif self.integrator == "euler":
+            self.accelerations(positions, acceleration)
+            velocities += np.multiply(acceleration, dt, out=delta)
+            positions += np.multiply(velocities, dt, out=delta)
+        else:
+            raise ValueError(f"unknown integrator {self.integrator!r}")
+        self.time += dt
+        self.steps += 1
+        for observer in self.observers:
+            observer(self)
+
+    def run(self, steps):
+        for _ in range(steps):
+            self.step()
+
+    def advance(self, frame_time):
+        """Run the steps that fit in frame_time (plus the rest of earlier frames), returns how many."""
+        self.accumulator += frame_time
+        steps = 0
+        while self.accumulator >= self.dt and steps < self.max_steps:
+            # interpolated() blends the last step, not everything since the last frame
+            self.previous[...] = self.positions
+            self.step()
+            self.accumulator -= self.dt
+            steps += 1
+        if steps == self.max_steps:
+            self.accumulator = min(self.accumulator, self.dt)
+        return steps
+
+    def interpolated(self):
+        # the positions frame_time into the current step, between the last two steps
+        alpha = self.accumulator / self.dt
+        return self.previous + alpha*(self.positions - self.previous)
+
+    def energy(self):
+        # the total energy of the orbiters (per unit mass), constant up to the integration error
+        kinetic = 0.5*(self.velocities**2).sum()
+        potential = 0.0
+        for attractor, strength in zip(self.attractors, self.strengths.tolist()):
+            offset = self.positions - attractor
+            potential -= (strength / np.sqrt((offset**2).sum(axis=1) + self.softening**2)).sum()
+        return kinetic + potential
+
+def circular_orbits(n, center, strength=8e6, softening=10.0, min_radius=50, max_radius=280, seed=0):
+    """n orbiters on circular orbits around center, returns the positions and velocities."""
+    rng = np.random.default_rng(seed)
+    radius = np.sqrt(rng.uniform(min_radius**2, max_radius**2, n))
+    angle = rng.uniform(0, 2*math.pi, n)
+    direction = np.stack((np.cos(angle), np.sin(angle)), axis=1)
+    positions = np.asarray(center, dtype=float) + radius[:, None]*direction
+    # the softened pull strength * r / (r^2 + softening^2)^(3/2) is the centripetal v^2 / r
+    speed = radius*np.sqrt(strength) / (radius**2 + softening**2)**0.75
+    velocities = speed[:, None]*np.stack((-direction[:, 1], direction[:, 0]), axis=1)
+    return positions, velocities
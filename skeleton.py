@@ -0,0 +1,114 @@
+"""
+Flat array skeleton for large 2D rigs
+
+A rig of J parts is stored as arrays: parent index (-1 for roots), position, rotation,
+scale, origin and size of every part, the same parameters hierarchical_modeling.Square
+has. The (J, 3, 3) local matrices are built in one go and forward kinematics walks the
+parts level by level (all parts of one depth at once), so a level costs one batched matmul
+however many parts it has. polygons() returns the corners of every part in one (J, 4, 2)
+array.
+"""
+import numpy as np
+import pygame
+
+
+def depth_levels(parents):
+    # the parts grouped by their depth in the hierarchy, roots first
+    parents = np.asarray(parents, dtype=np.int64)
+    n = len(parents)
+    # children of every part, sorted by parent (compressed like a sparse matrix)
+    has_parent = parents >= 0
+    children = np.flatnonzero(has_parent)[np.argsort(parents[has_parent], kind="stable")]
+    counts = np.bincount(parents[has_parent], minlength=n)
+    starts = np.cumsum(counts) - counts
+
+    levels = []
+    level = np.flatnonzero(~has_parent)
+    while len(level):
+        levels.append(level)
+        c = counts[level]
+        first = np.repeat(np.cumsum(c) - c, c)
+        level = children[np.repeat(starts[level], c) + np.arange(c.sum()) - first]
+    if sum(len(level) for level in levels) != n:
+        raise ValueError("the parent indices contain a cycle")
+    return levels
+
+def local_matrices(positions, rotations, scales, origins):
+    # the batched Square.get_local_transform:
+    # translate(position) @ translate(origin) @ rotate(rotation) @ translate(-origin) @ scale(scale)
+    c, s = np.cos(rotations), np.sin(rotations)
+    mats = np.zeros((len(rotations), 3, 3))
+    mats[:, 0, 0] = c*scales[:, 0]
+    mats[:, 0, 1] = s*scales[:, 1]
+    mats[:, 1, 0] = -s*scales[:, 0]
+    mats[:, 1, 1] = c*scales[:, 1]
+    ox, oy = origins[:, 0], origins[:, 1]
+    mats[:, 0, 2] = positions[:, 0] + ox - (c*ox + s*oy)
+    mats[:, 1, 2] = positions[:, 1] + oy - (-s*ox + c*oy)
+    mats[:, 2, 2] = 1
+    return mats
+
+class Skeleton:
+
+    def __init__(self, parents, positions, sizes, rotations=None, scales=None, origins=None, colors=None):
+        self.parents = np.asarray(parents, dtype=np.int64)
+        n = len(self.parents)
+        self.positions = np.array(positions, dtype=float).reshape(n, 2)
+        self.sizes = np.array(sizes, dtype=float).reshape(n, 2)
+        self.rotations = np.zeros(n) if rotations is None else np.array(rotations, dtype=float)
+        self.scales = np.ones((n, 2)) if scales is None else np.array(scales, dtype=float).reshape(n, 2)
+        self.origins = np.zeros((n, 2)) if origins is None else np.array(origins, dtype=float).reshape(n, 2)
+        self.colors = np.full((n, 3), 255) if colors is None else np.array(colors, dtype=int).reshape(n, 3)
+        self.levels = depth_levels(self.parents)
+        self.world = None
+
+    @classmethod
+    def from_squares(self, squares):
+        """A Skeleton with the parts of hierarchical_modeling.Square objects (parents included in squares)."""
+        index = dict((id(square), i) for i, square in enumerate(squares))
+        return Skeleton(
+                [-1 if square.parent is None else index[id(square.parent)] for square in squares],
+                [tuple(square.position) for square in squares],
+                [tuple(square.points[2]) for square in squares],
+                [square.rotation for square in squares],
+                [tuple(square.scale) for square in squares],
+                [tuple(square.origin) for square in squares],
+                [tuple(square.color) for square in squares],
+        )
+
+    def local_matrices(self):
+        return local_matrices(self.positions, self.rotations, self.scales, self.origins)
+
+    def forward_kinematics(self):
+        """
+        The (J, 3, 3) world matrices, one batched matmul per depth level. Call it after
+        changing the arrays, polygons and world_origins use the matrices of the last call.
+        """
+        world = self.local_matrices()
+        for level in self.levels[1:]:
+            world[level] = world[self.parents[level]] @ world[level]
+        self.world = world
+        return world
+
+    def world_origins(self):
+        # the pivot of every part in world space, (J, 2)
+        world = self.forward_kinematics() if self.world is None else self.world
+        return (world[:, :2, :2] @ self.origins[:, :, None])[:, :, 0] + world[:, :2, 2]
+
+    def polygons(self):
+        """The world space corners of every part, (J, 4, 2)."""
+        world = self.forward_kinematics() if self.world is None else self.world
+        w, h = self.sizes[:, 0], self.sizes[:, 1]
+        zero = np.zeros_like(w)
+        corners = np.stack((
+            np.stack((zero, zero), axis=1),
+            np.stack((w, zero), axis=1),
+            np.stack((w, h), axis=1),
+            np.stack((zero, h), axis=1),
+        ), axis=1)
+        return corners @ world[:, :2, :2].transpose(0, 2, 1) + world[:, None, :2, 2]
+
+    def draw(self, surface=None):
+        surface = pygame.display.get_surface() if surface is None else surface
+        for polygon, color in zip(self.polygons().tolist(), self.colors.tolist()):
+            pygame.draw.polygon(surface, color, polygon)
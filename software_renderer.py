@@ -1,52 +1,41 @@
+import os
+import sys
+if __name__ == "__main__" and "--bench" in sys.argv:
+    # headless, and keep the pygame banner out of the JSON report
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
 import pygame
 import numpy as np
 import math
-import sys
 from slider import Slider
-pygame.init()
+from obj_parser import load_obj
+from mesh_cache import load_mesh
+from rasterizer import DepthBuffer, draw_tris_zbuffered
+from tiled_raster import TiledRasterizer
+from transform import Transform, transform_points, transform_points_batch, camera_key
+from mesh import Mesh
+from obj_export import export_obj
+from scene import Frustum
+from profiler import Profiler
+from frame_cache import FrameCache
 
 
 SCREEN_WIDTH, SCREEN_HEIGHT = 800, 600
 light_dir = np.array([-1, 0, -1])
 light_dir = light_dir / math.sqrt(light_dir.dot(light_dir))
 
-def create_obj_txt(verts, inds):
-
-    txt = ""
-    for i, vert in enumerate(verts):
-        if i%3 == 0:
-            txt += "\nv"
-        txt += f" {vert}"
-    txt += "\n"
-    for i, ind in enumerate(inds):
-        if i%3 == 0:
-            txt += "\nf"
-        txt += f" {ind + 1}"
-    return txt
-
-def read_obj(filename):
-    data = ""
-    vertices = []
-    indices = []
+def read_obj_uncached(filename):
+    # returns the vertices as an (N, 3) array and the triangulated faces as an (M, 3) array
     try:
-        with open(filename, "r") as file:
-            data = file.read()
-    except:
+        mesh = load_obj(filename)
+    except OSError:
         print(f"{filename} not found")
         return (None, None)
+    return (mesh.vertices, mesh.indices)
 
-    lines = data.split("\n")
-    for line in lines:
-        # if not line or line.startswith("o") or line.startswith("#"):
-        #     continue
-        blocks = line.split(" ")
-        if line.startswith("v"):
-            for i in range(1, 4):
-                vertices.append(float(blocks[i]))
-        elif line.startswith("f"):
-            for i in range(1, 4):
-                indices.append(int(blocks[i]) - 1)
-    return (vertices, indices)
+def read_obj(filename):
+    # read_obj_uncached through the .meshcache sidecar, later loads memory-map the parsed arrays
+    return load_mesh(filename, read_obj_uncached)
 
 class Camera:
 
@@ -70,90 +59,249 @@ class Camera:
         y = y*flen/(self.position[2]-z)
         return (x, y)
     
-def ntos(point):
-    x = point[0]
-    y = point[1]
-    x = (x + 1)/2 * SCREEN_WIDTH
-    y = (1 - y)/2 * SCREEN_HEIGHT
-    return (int(x), int(y))
-
-def create_rot_mat(angle):
-    rot_1 = np.array([
-        [math.cos(angle),  0, math.sin(angle)],
-        [0,                1,               0],
-        [-math.sin(angle), 0, math.cos(angle)],
-    ])
-
-    rot_2 = np.array([
-        [1, 0, 0],
-        [0, math.cos(angle), math.sin(angle)],
-        [0, -math.sin(angle), math.cos(angle)],
-    ])
-    rot = rot_1@rot_2
-    return rot
-
-def create_scale_mat(scale):
-    mat = np.array([
-        [scale[0],      0,               0],
-        [0,             scale[1],        0],
-        [0,             0,        scale[2]],
-    ])
-    return mat
-
-def apply_transform(points, tr):
-    ps = []
-    for point in points:
-        ps.append(tr@point)
-    return ps
-
-
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.RESIZABLE)
-pygame.display.set_caption("rotating cube")
-
-def project_all_tris(cam, verts, inds, angle=0, scale=(1, 1, 1)):
-    tris = []
-    i = 0
-    while i < len(inds) - 2:
-        v1 = np.array([verts[3*inds[i]], verts[3*inds[i]+1], verts[3*inds[i]+2]])
-        v2 = np.array([verts[3*inds[i+1]], verts[3*inds[i+1]+1], verts[3*inds[i+1]+2]])
-        v3 = np.array([verts[3*inds[i+2]], verts[3*inds[i+2]+1], verts[3*inds[i+2]+2]])
-        v1, v2, v3 = apply_transform((v1, v2, v3), create_scale_mat(scale))
-        v1, v2, v3 = apply_transform((v1, v2, v3), create_rot_mat(angle))
-        p1 = cam.project_point(v1)
-        p2 = cam.project_point(v2)
-        p3 = cam.project_point(v3)
-        if p1 is None or p2 is None or p3 is None:
-            i += 3
-            continue
-        facing_mat = np.array([
-            [1,         1,          1],
-            [p1[0],     p2[0],  p3[0]],
-            [p1[1],     p2[1],  p3[1]]
-        ])
-        if np.linalg.det(facing_mat) <= 0: # cull back-faces and collinear points
-            i += 3
-            continue
-        tris.append([p1, p2, p3, v1, v2, v3])
-        i += 3
-    return tris
-
-def draw_tris(cam, verts, inds, angle=0, line_width=0, color=(255, 0, 0), scale=(1, 1, 1)):
-    tris = project_all_tris(cam, verts, inds, angle, scale)
-    for tri in tris:
-        p1, p2, p3, v1, v2, v3 = tri
-        p1 = ntos(p1)
-        p2 = ntos(p2)
-        p3 = ntos(p3)
-        v2v3 = v3-v2
-        v2v1 = v1-v2
-        normal = np.cross(v2v3, v2v1)
-        if normal.dot(normal) == 0:
-            continue
-        normal /= math.sqrt(normal.dot(normal))
-        f = normal.dot(-light_dir)
-        f = 0 if f < 0 else f
-        c = [min(int(col * f), 255) for col in color]
-        pygame.draw.polygon(screen, c, (p1, p2, p3), line_width)
+def ntos_all(points, dtype=int):
+    # normalized device coordinates to screen pixels for a (..., 2) array
+    screen_points = np.empty(points.shape, dtype=dtype)
+    screen_points[..., 0] = (points[..., 0] + 1)/2 * SCREEN_WIDTH
+    screen_points[..., 1] = (1 - points[..., 1])/2 * SCREEN_HEIGHT
+    return screen_points
+
+def as_mesh_arrays(verts, inds):
+    # accepts the flat lists returned by read_obj as well as (N, 3)/(M, 3) arrays
+    verts = np.asarray(verts, dtype=float).reshape(-1, 3)
+    inds = np.asarray(inds, dtype=np.int64).ravel()
+    inds = inds[:len(inds) - len(inds) % 3].reshape(-1, 3)
+    return verts, inds
+
+def as_mesh(verts, inds):
+    # a Mesh (with its normals) for the vertices/indices, built again on every call as plain
+    # arrays may have been edited in place since the last one, callers that draw the same
+    # geometry every frame pass a Mesh and keep it up to date with Mesh.update
+    if isinstance(verts, Mesh):
+        return verts
+    return Mesh(verts, inds)
+
+def transform_vertices(cam, verts, transform, mesh=None):
+    # the indexed vertex stage: world space position, projected position and near plane mask of
+    # every unique vertex. For a Mesh the result is reused while its version, the model matrix
+    # and the camera stay the same (the wireframe pass draws the mesh a second time in the same
+    # frame), plain arrays can be edited in place without anyone noticing so they aren't cached
+    model = transform.get_model_matrix()
+    transform.get_view_projection_matrix(cam)
+    if mesh is not None:
+        key = (mesh.version, transform.version, transform.camera)
+        entry = vertex_cache.get(id(mesh))
+        # the entry holds on to the mesh, its id can't be reused while it is cached
+        if entry is not None and entry[0] is mesh and entry[1] is transform and entry[2] == key:
+            return entry[3]
+    world_verts = transform_points(model, verts)
+    point_verts, visible = transform.project(cam, world_verts)
+    if mesh is None:
+        return world_verts, point_verts, visible
+    if len(vertex_cache) >= 8:
+        vertex_cache.pop(next(iter(vertex_cache)))
+    vertex_cache[id(mesh)] = (mesh, transform, key, (world_verts, point_verts, visible))
+    return world_verts, point_verts, visible
+
+def project_all_tris(cam, verts, inds, angle=0, scale=(1, 1, 1), transform=None):
+    # verts can be a Mesh (inds is ignored then), its projected vertices are cached
+    # angle and scale are ignored when an explicit Transform is passed
+    # returns the projected corners, the world space corners and the face index of every visible triangle
+    mesh = None
+    if isinstance(verts, Mesh):
+        mesh = verts
+        verts, inds = mesh.vertices, mesh.indices
+    verts, inds = as_mesh_arrays(verts, inds)
+    if transform is None:
+        transform = model_transform
+        transform.set_angle(angle)
+        transform.set_scale(scale)
+
+    # every unique vertex is transformed and projected once, the triangles gather the results
+    # by index (np.take gathers whole rows several times faster than fancy indexing)
+    world_verts, point_verts, visible = transform_vertices(cam, verts, transform, mesh)
+
+    # reject triangles with a corner behind the near plane
+    faces = np.flatnonzero(np.take(visible, inds).all(axis=1))
+    corners = np.take(inds, faces, axis=0)
+    points = np.take(point_verts, corners, axis=0)
+
+    # cull back-faces and collinear points (the sign of the screen space area)
+    e1 = points[:, 1] - points[:, 0]
+    e2 = points[:, 2] - points[:, 0]
+    area = e1[:, 0]*e2[:, 1] - e2[:, 0]*e1[:, 1]
+    front = np.flatnonzero(area > 0)
+    world = np.take(world_verts, np.take(corners, front, axis=0), axis=0)
+    return np.take(points, front, axis=0), world, np.take(faces, front)
+
+def project_instances(cam, mesh, models):
+    # project_all_tris for K copies of a Mesh, models is a (K, 4, 4) stack of model matrices
+    # returns the projected corners, the world space corners, the copy and the face index of every visible triangle
+    models = np.asarray(models, dtype=float).reshape(-1, 4, 4)
+
+    # drop whole copies outside the view frustum before any per-vertex work
+    frustum = Frustum.from_matrix(model_transform.get_view_projection_matrix(cam))
+    centers = models[:, :3, :3] @ mesh.center + models[:, :3, 3]
+    radii = mesh.radius * np.sqrt((models[:, :3, :3]**2).sum(axis=1)).max(axis=1)
+    instances = np.flatnonzero(frustum.test_spheres(centers, radii))
+    models = models[instances]
+
+    # every vertex is transformed and projected once per copy, the triangles gather them afterwards
+    n_verts, n_faces = len(mesh.vertices), len(mesh.indices)
+    world_verts = transform_points_batch(models, mesh.vertices).reshape(-1, 3)
+    point_verts, visible = model_transform.project(cam, world_verts)
+    corners = (np.arange(len(models))[:, None, None]*n_verts + mesh.indices).reshape(-1, 3)
+
+    # reject triangles with a corner behind the near plane
+    # (np.take gathers whole rows several times faster than fancy indexing)
+    keep = np.flatnonzero(np.take(visible, corners).all(axis=1))
+    corners = np.take(corners, keep, axis=0)
+    points = np.take(point_verts, corners, axis=0)
+
+    # cull back-faces and collinear points, only the front faces gather their world space corners
+    e1 = points[:, 1] - points[:, 0]
+    e2 = points[:, 2] - points[:, 0]
+    area = e1[:, 0]*e2[:, 1] - e2[:, 0]*e1[:, 1]
+    front = np.flatnonzero(area > 0)
+    world = np.take(world_verts, np.take(corners, front, axis=0), axis=0)
+    copies, faces = np.divmod(np.take(keep, front), n_faces)
+    return np.take(points, front, axis=0), world, np.take(instances, copies), faces
+
+def shade_tris(world, color, normals=None):
+    # normals: world space face normals (T, 3) for flat shading or corner normals (T, 3, 3)
+    # for gouraud shading, computed from the world space corners when not given
+    # returns a mask of the triangles with a valid normal and their (T, 3) or (T, 3, 3) colors
+    if normals is None:
+        v1, v2, v3 = world[:, 0], world[:, 1], world[:, 2]
+        normals = np.cross(v3 - v2, v1 - v2)
+    lengths = np.sqrt((normals*normals).sum(axis=-1))
+    if normals.ndim == 2:
+        lit = lengths > 0
+        f = (normals[lit] @ -light_dir) / lengths[lit]
+    else:
+        lit = np.ones(len(normals), dtype=bool)
+        f = (normals @ -light_dir) / np.where(lengths > 0, lengths, np.inf)
+    f = np.maximum(f, 0)
+    colors = np.minimum((np.asarray(color)*f[..., None]).astype(int), 255)
+    return lit, colors
+
+def get_tiled_rasterizer():
+    # the worker processes are only started once the tiled backend is used
+    global tiled_rasterizer
+    if tiled_rasterizer is None:
+        tiled_rasterizer = TiledRasterizer(tile_workers)
+    return tiled_rasterizer
+
+def clear_depth(size):
+    depth_buffer.clear(size)
+    if tiled_rasterizer is not None:
+        tiled_rasterizer.clear(size)
+
+def screen_rect(points, line_width=0):
+    # the pygame.Rect covering the projected points (plus the line width), None if there are none
+    if not len(points):
+        return None
+    screen_points = ntos_all(points.reshape(-1, 2))
+    x0, y0 = screen_points.min(axis=0).tolist()
+    x1, y1 = screen_points.max(axis=0).tolist()
+    pad = line_width + 1
+    return pygame.Rect(x0 - pad, y0 - pad, x1 - x0 + 2*pad + 1, y1 - y0 + 2*pad + 1)
+
+def raster_tris(surface, cam, points, world, colors, line_width=0, backend="polygon"):
+    if backend in ("zbuffer", "tiled") and line_width == 0:
+        depths = cam.position[2] - world[..., 2]
+        if backend == "tiled":
+            get_tiled_rasterizer().draw(surface, ntos_all(points, float), depths, colors)
+        else:
+            draw_tris_zbuffered(surface, depth_buffer, ntos_all(points, float), depths, colors)
+        return
+
+    if colors.ndim == 3:
+        # pygame.draw.polygon can't interpolate, use the average of the corners
+        colors = colors.mean(axis=1).astype(int)
+    screen_points = ntos_all(points)
+    for tri, c in zip(screen_points.tolist(), colors.tolist()):
+        pygame.draw.polygon(surface, c, tri, line_width)
+
+def draw_tris(cam, verts, inds, angle=0, line_width=0, color=(255, 0, 0), scale=(1, 1, 1), backend="polygon", surface=None, shading="flat", transform=None):
+    # backend: "polygon" draws the triangles in order with pygame.draw.polygon,
+    # "zbuffer" rasterizes them with a depth test (filled triangles only),
+    # "tiled" does the same as "zbuffer" in parallel in tile_workers processes
+    # shading: "flat" (one color per face) or "gouraud" (vertex normals, interpolated by the raster backends)
+    # an explicit Transform replaces angle and scale
+    # returns the screen rectangle that was drawn to (None if nothing was drawn)
+    surface = pygame.display.get_surface() if surface is None else surface
+    mesh = as_mesh(verts, inds)
+    if transform is None:
+        transform = model_transform
+        transform.set_angle(angle)
+        transform.set_scale(scale)
+    with frame_profiler.stage("project"):
+        points, world, faces = project_all_tris(cam, mesh, None, transform=transform)
+    with frame_profiler.stage("shade"):
+        normals = mesh.world_normals(faces, transform.get_model_matrix(), shading)
+        lit, colors = shade_tris(world, color, normals)
+    with frame_profiler.stage("raster"):
+        raster_tris(surface, cam, points[lit], world[lit], colors, line_width, backend)
+    frame_profiler.count("submitted", len(mesh.indices))
+    frame_profiler.count("culled", len(mesh.indices) - len(colors))
+    return screen_rect(points[lit], line_width)
+
+def draw_instances(cam, verts, inds, models, line_width=0, color=(255, 0, 0), backend="polygon", surface=None, shading="flat"):
+    # draw_tris for many copies of one mesh, models is a (K, 4, 4) stack of model matrices
+    # all copies are projected, culled, shaded and rasterized together in one batch
+    # returns the number of triangles drawn
+    surface = pygame.display.get_surface() if surface is None else surface
+    mesh = as_mesh(verts, inds)
+    models = np.asarray(models, dtype=float).reshape(-1, 4, 4)
+    with frame_profiler.stage("project"):
+        points, world, instances, faces = project_instances(cam, mesh, models)
+    with frame_profiler.stage("shade"):
+        normals = mesh.instance_normals(instances, faces, models, shading)
+        lit, colors = shade_tris(world, color, normals)
+    with frame_profiler.stage("raster"):
+        raster_tris(surface, cam, points[lit], world[lit], colors, line_width, backend)
+    frame_profiler.count("submitted", len(models)*len(mesh.indices))
+    frame_profiler.count("culled", len(models)*len(mesh.indices) - len(colors))
+    return len(colors)
+
+def pixels_per_unit(cam, center, model):
+    # how many pixels one object space unit covers at the (world space) center of the object
+    dist = max(cam.position[2] - center[2], cam.near)
+    flen = cam.aspect_ratio/(2*math.tan(cam.fov))
+    stretch = np.sqrt((model[:3, :3]**2).sum(axis=0)).max()
+    return SCREEN_HEIGHT/2 * flen/dist * stretch
+
+def select_lod(cam, lods, transform, error_budget=None):
+    # the coarsest level of a decimate.LodChain whose error stays under error_budget pixels
+    error_budget = lod_error_budget if error_budget is None else error_budget
+    model = transform.get_model_matrix()
+    center = transform_points(model, lods.levels[0].center)
+    return lods.select(pixels_per_unit(cam, center, model), error_budget)
+
+def draw_lod(cam, lods, angle=0, line_width=0, color=(255, 0, 0), scale=(1, 1, 1), backend="polygon", surface=None, shading="flat", transform=None, error_budget=None):
+    # draw_tris for a decimate.LodChain, picks the level from the projected size of the object
+    # returns the level drawn
+    if transform is None:
+        transform = model_transform
+        transform.set_angle(angle)
+        transform.set_scale(scale)
+    level = select_lod(cam, lods, transform, error_budget)
+    draw_tris(cam, lods.levels[level], None, line_width=line_width, color=color, backend=backend, surface=surface, shading=shading, transform=transform)
+    return level
+
+def draw_scene(cam, scene, line_width=0, backend="polygon", surface=None, shading="flat"):
+    # draws the objects of a scene.Scene, objects outside the view frustum are culled as a whole
+    # and objects with a LodChain are drawn at the level their size on the screen calls for
+    # returns the number of objects drawn
+    with frame_profiler.stage("cull"):
+        objects = scene.visible_objects(cam)
+    for obj in objects:
+        if obj.lods is not None:
+            draw_lod(cam, obj.lods, line_width=line_width, color=obj.color, backend=backend, surface=surface, shading=shading, transform=obj.transform)
+        else:
+            draw_tris(cam, obj.mesh, None, line_width=line_width, color=obj.color, backend=backend, surface=surface, shading=shading, transform=obj.transform)
+    return len(objects)
 
 camera = Camera(
         math.pi/4.0,
@@ -163,10 +311,38 @@ camera = Camera(
         np.array([0, 0, 3])
 )
 
-
-clock = pygame.time.Clock()
-delta = 0
-angle = 0
+# the model/view/projection matrices, only rebuilt when a slider or the camera changes
+model_transform = Transform()
+# id(mesh) -> (mesh, transform, versions, projected vertices), see transform_vertices
+vertex_cache = {}
+
+# stage timings for the HUD (H) and trace dumps (P), costs next to nothing while disabled
+frame_profiler = Profiler()
+show_hud = False
+trace_filename = "trace.json"
+
+# retained mode (R) renders the mesh only when the sliders, keys or window changed and pushes
+# only the changed parts of the window, an idle viewer just polls for events
+retained = True
+frame_cache = FrameCache()
+idle_fps = 30
+
+# largest error (in pixels) a simplified level of detail may show, see decimate.py
+lod_error_budget = 1.0
+# press G to switch between flat and gouraud shading
+shading = "flat"
+# press SPACE to export the mesh in the background
+export_job = None
+export_format = "obj" # "obj", "gzip" or "binary"
+export_filenames = {"obj": "out.obj", "gzip": "out.obj.gz", "binary": "out.npz"}
+
+depth_buffer = DepthBuffer()
+tiled_rasterizer = None
+tile_workers = None # defaults to the number of cores
+# press B to switch between the backends
+raster_backends = ["polygon", "zbuffer", "tiled"]
+# pygame.draw.polygon is by far the fastest on small meshes
+raster_backend = "polygon"
 
 bg_start_color = pygame.math.Vector3(0, 0, 50)
 bg_end_color = pygame.math.Vector3(50, 50, 50)
@@ -181,13 +357,6 @@ def create_bg():
         y += SCREEN_HEIGHT//n
     return bg
 
-bg = create_bg()
-slider_x = Slider(x=10, y=10, color=(255, 0, 0), value=50)
-slider_y = Slider(x=10, y=40, color=(0, 255, 0), value=50)
-slider_z = Slider(x=10, y=70, color=(0, 0, 255), value=50)
-slider_rot = Slider(x=10, y=100, color=(255, 255, 0))
-slider_wireframe = Slider(x=50, y=130, color=(0, 0, 0), w=20)
-
 vertices = [
         -0.5, 0.5, 0,
         0.5, 0.5, 0,
@@ -227,21 +396,15 @@ scale = (1, 1, 1)
 def freeze_transformations():
     global scale
     global vertices
+    global mesh
     global slider_x
     global slider_y
     global slider_z
-    scale_mat = create_scale_mat(scale)
+    model_transform.set_scale(scale)
 
-    verts_new = []
     # transform the vertices
-    i = 0
-    while i < len(vertices) - 2:
-        vertex = np.array([vertices[i], vertices[i + 1], vertices[i + 2]])
-        vertex_transformed = scale_mat@vertex
-        verts_new.append(vertex_transformed[0])
-        verts_new.append(vertex_transformed[1])
-        verts_new.append(vertex_transformed[2])
-        i += 3
+    verts, _ = as_mesh_arrays(vertices, [])
+    verts_new = transform_points(model_transform.get_scale_matrix(), verts)
 
     # reset the sliders
     slider_x.value = 50
@@ -250,53 +413,150 @@ def freeze_transformations():
 
     # set the vertices
     vertices = verts_new
-
-while True:
-
-    screen.fill((0, 0, 0))
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-        if event.type == pygame.WINDOWRESIZED:
-            SCREEN_WIDTH = screen.get_rect().width
-            SCREEN_HEIGHT = screen.get_rect().height
-            camera.aspect_ratio = SCREEN_WIDTH/SCREEN_HEIGHT
-            bg = create_bg()
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_SPACE:
-                obj_txt = create_obj_txt(vertices, indices)
-                with open("out.obj", "w") as file:
-                    file.write(obj_txt)
-
-    slider_x.update()
-    slider_y.update()
-    slider_z.update()
-    slider_rot.update()
-    slider_wireframe.update()
-    key = pygame.key.get_pressed()
-    if key[pygame.K_RETURN]:
-        freeze_transformations()
-
-    screen.blit(bg, (0, 0))
-    angle = slider_rot.value / 99 * 2 * math.pi
-    scale = (slider_x.value/100 * 2, slider_y.value/100 * 2, slider_z.value/100 * 2)
-    draw_tris(camera, vertices, indices, angle=angle, line_width=0, color=(255, 255, 255), scale=scale)
-    if slider_wireframe.value > 50:
-        slider_wireframe.value = 99
-        slider_wireframe.color = (0, 0, 255)
-        draw_tris(camera, vertices, indices, angle, 1, (0, 0, 255), scale)
-    else:
-        slider_wireframe.value = 0
-        slider_wireframe.color = (100, 100, 100)
-    slider_x.draw()
-    slider_y.draw()
-    slider_z.draw()
-    slider_rot.draw()
-    slider_wireframe.draw()
-    pygame.display.update()
-    clock.tick()
-    fps = clock.get_fps()
-    if fps:
-        delta = 1 / fps
-    # angle += rot_speed*delta
+    mesh.update(vertices)
+    frame_cache.invalidate()
+
+def main():
+    global SCREEN_WIDTH, SCREEN_HEIGHT, scale, raster_backend, shading, export_job, show_hud, retained
+    global slider_x, slider_y, slider_z, slider_rot, slider_wireframe, mesh
+    pygame.init()
+    # the normals are computed once here, freeze_transformations updates the mesh
+    mesh = Mesh(vertices, indices)
+
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.RESIZABLE)
+    pygame.display.set_caption("rotating cube")
+
+    clock = pygame.time.Clock()
+    delta = 0
+    angle = 0
+
+    bg = create_bg()
+    slider_x = Slider(x=10, y=10, color=(255, 0, 0), value=50)
+    slider_y = Slider(x=10, y=40, color=(0, 255, 0), value=50)
+    slider_z = Slider(x=10, y=70, color=(0, 0, 255), value=50)
+    slider_rot = Slider(x=10, y=100, color=(255, 255, 0))
+    slider_wireframe = Slider(x=50, y=130, color=(0, 0, 0), w=20)
+    sliders = [slider_x, slider_y, slider_z, slider_rot, slider_wireframe]
+    # the part of the window the sliders draw to
+    slider_rect = pygame.Rect(0, 0, 130, 150)
+    hud_rect = None
+
+    def render_mesh_layer(layer):
+        with frame_profiler.stage("clear"):
+            layer.blit(bg, (0, 0))
+            clear_depth(layer.get_size())
+        rect = draw_tris(camera, mesh, None, angle=angle, line_width=0, color=(255, 255, 255), scale=scale, backend=raster_backend, surface=layer, shading=shading)
+        if slider_wireframe.value == 99:
+            wire_rect = draw_tris(camera, mesh, None, angle, 1, (0, 0, 255), scale, surface=layer)
+            if rect is None:
+                rect = wire_rect
+            elif wire_rect is not None:
+                rect = rect.union(wire_rect)
+        return rect
+
+    while True:
+
+        frame_profiler.begin_frame()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            if event.type == pygame.WINDOWRESIZED:
+                SCREEN_WIDTH = screen.get_rect().width
+                SCREEN_HEIGHT = screen.get_rect().height
+                camera.aspect_ratio = SCREEN_WIDTH/SCREEN_HEIGHT
+                with frame_profiler.stage("background"):
+                    bg = create_bg()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_h:
+                    show_hud = not show_hud
+                    frame_profiler.set_enabled(show_hud)
+                if event.key == pygame.K_r:
+                    retained = not retained
+                    frame_cache.invalidate()
+                if event.key == pygame.K_p and frame_profiler.enabled:
+                    frame_profiler.dump(trace_filename)
+                    print(f"trace written to {trace_filename}")
+                if event.key == pygame.K_b:
+                    raster_backend = raster_backends[(raster_backends.index(raster_backend) + 1) % len(raster_backends)]
+                if event.key == pygame.K_g:
+                    shading = "gouraud" if shading == "flat" else "flat"
+                if event.key == pygame.K_SPACE and export_job is None:
+                    export_job = export_obj(export_filenames[export_format], vertices, indices, export_format, model_transform)
+
+        if export_job is not None:
+            if export_job.done():
+                if export_job.error is not None:
+                    print(f"export failed: {export_job.error}")
+                pygame.display.set_caption("rotating cube")
+                export_job = None
+            else:
+                pygame.display.set_caption(f"rotating cube - exporting {int(export_job.progress*100)}%")
+
+        slider_x.update()
+        slider_y.update()
+        slider_z.update()
+        slider_rot.update()
+        slider_wireframe.update()
+        key = pygame.key.get_pressed()
+        if key[pygame.K_RETURN]:
+            freeze_transformations()
+
+        angle = slider_rot.value / 99 * 2 * math.pi
+        scale = (slider_x.value/100 * 2, slider_y.value/100 * 2, slider_z.value/100 * 2)
+        if slider_wireframe.value > 50:
+            slider_wireframe.value = 99
+            slider_wireframe.color = (0, 0, 255)
+        else:
+            slider_wireframe.value = 0
+            slider_wireframe.color = (100, 100, 100)
+
+        if retained:
+            state = (angle, scale, slider_wireframe.value, raster_backend, shading, camera_key(camera))
+            rendered = frame_cache.update(state, screen.get_size(), render_mesh_layer)
+            dirty = rendered + [slider_rect] if rendered else []
+            if hud_rect is not None:
+                # the HUD changes every frame, put back what was under it
+                dirty.append(hud_rect)
+                hud_rect = None
+            if dirty or show_hud:
+                frame_cache.restore(screen, dirty)
+                for slider in sliders:
+                    slider.draw()
+                if show_hud:
+                    hud_rect = frame_profiler.draw_hud(screen)
+                    if hud_rect is not None:
+                        dirty.append(hud_rect)
+                with frame_profiler.stage("present"):
+                    pygame.display.update(dirty)
+            frame_profiler.end_frame()
+            # when the mesh didn't change sleep until the next poll instead of spinning
+            clock.tick(0 if rendered else idle_fps)
+        else:
+            with frame_profiler.stage("clear"):
+                screen.fill((0, 0, 0))
+                screen.blit(bg, (0, 0))
+                clear_depth(screen.get_size())
+            draw_tris(camera, mesh, None, angle=angle, line_width=0, color=(255, 255, 255), scale=scale, backend=raster_backend, shading=shading)
+            if slider_wireframe.value == 99:
+                draw_tris(camera, mesh, None, angle, 1, (0, 0, 255), scale)
+            for slider in sliders:
+                slider.draw()
+            if show_hud:
+                frame_profiler.draw_hud(screen)
+            with frame_profiler.stage("present"):
+                pygame.display.update()
+            frame_profiler.end_frame()
+            clock.tick()
+        fps = clock.get_fps()
+        if fps:
+            delta = 1 / fps
+        # angle += rot_speed*delta
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        # headless benchmark, see benchmark.py
+        import benchmark
+        sys.exit(benchmark.main(sys.argv[1:]))
+    main()
@@ -0,0 +1,76 @@
+"""
+Uniform grid spatial hash for picking
+
+Items are stored by the grid cell of their position, a query only looks at the cells its
+circle overlaps, so picking stays cheap however many items there are. Items are any
+hashable keys (point indices, gizmo objects), their positions are kept by the caller.
+"""
+import numpy as np
+
+
+class SpatialHash:
+
+    def __init__(self, cell_size=16):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.item_cells = {}
+
+    def cell(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def clear(self):
+        self.cells = {}
+        self.item_cells = {}
+
+    def insert(self, item, x, y):
+        key = self.cell(x, y)
+        self.item_cells[item] = key
+        self.cells.setdefault(key, set()).add(item)
+
+    def remove(self, item):
+        key = self.item_cells.pop(item, None)
+        if key is not None:
+            items = self.cells[key]
+            items.discard(item)
+            if not items:
+                del self.cells[key]
+
+    def move(self, item, x, y):
+        # only touches the cells when the item left its cell
+        key = self.cell(x, y)
+        if self.item_cells.get(item) != key:
+            self.remove(item)
+            self.item_cells[item] = key
+            self.cells.setdefault(key, set()).add(item)
+
+    def build(self, positions):
+        """Replace the contents with the indices of an (N, 2) array of positions."""
+        self.clear()
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if not len(positions):
+            return
+        keys = np.floor(positions / self.cell_size).astype(np.int64)
+        # group the indices by cell with one sort instead of one dict lookup per point
+        order = np.lexsort((keys[:, 1], keys[:, 0]))
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], (keys[1:] != keys[:-1]).any(axis=1))))
+        ends = np.append(starts[1:], len(order))
+        order = order.tolist()
+        for start, end, key in zip(starts.tolist(), ends.tolist(), keys[starts].tolist()):
+            key = tuple(key)
+            items = set(order[start:end])
+            self.cells[key] = items
+            for item in items:
+                self.item_cells[item] = key
+
+    def query(self, x, y, radius):
+        """The items in the cells overlapped by the circle (candidates, test their distance)."""
+        x0, y0 = self.cell(x - radius, y - radius)
+        x1, y1 = self.cell(x + radius, y + radius)
+        found = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                items = self.cells.get((cx, cy))
+                if items:
+                    found.extend(items)
+        return found
@@ -0,0 +1,210 @@
+"""
+Loop subdivision of triangle meshes
+
+Every level of Loop subdivision is linear in the vertex positions, so the topology is worked
+out once: the edge list, the crease edges and the new faces are built with array
+operations and the vertex rules are written into a sparse subdivision matrix S per level.
+The matrices of all levels are multiplied into one, so the subdivided vertices are a single
+sparse mat-vec, S @ base_vertices, and editing the base mesh never rebuilds the topology.
+A moved base vertex only updates the rows of its column.
+
+SparseMatrix is a small CSR matrix on NumPy arrays, just what is needed here.
+"""
+import math
+
+import numpy as np
+
+from mesh import Mesh
+
+
+class SparseMatrix:
+
+    def __init__(self, indptr, indices, data, shape):
+        # compressed rows: the entries of row r are indices/data[indptr[r]:indptr[r + 1]]
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = shape
+        self.rows = np.repeat(np.arange(shape[0]), np.diff(indptr))
+
+    @classmethod
+    def from_coo(self, rows, cols, data, shape):
+        # duplicate (row, col) entries are summed
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        keys, inverse = np.unique(rows*shape[1] + cols, return_inverse=True)
+        data = np.bincount(inverse.ravel(), weights=data, minlength=len(keys))
+        rows, cols = np.divmod(keys, shape[1])
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return SparseMatrix(indptr, cols, data, shape)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def transpose(self):
+        return SparseMatrix.from_coo(self.indices, self.rows, self.data, (self.shape[1], self.shape[0]))
+
+    def dot(self, x):
+        # dense (K,) or (K, D) x
+        x = np.asarray(x, dtype=float)
+        if x.ndim == 1:
+            return np.bincount(self.rows, weights=self.data*x[self.indices], minlength=self.shape[0])
+        gathered = x[self.indices]*self.data[:, None]
+        out = np.empty((self.shape[0], x.shape[1]))
+        for k in range(x.shape[1]):
+            out[:, k] = np.bincount(self.rows, weights=gathered[:, k], minlength=self.shape[0])
+        return out
+
+    def matmul(self, other):
+        # product with another SparseMatrix: every entry (r, k) of self meets the row k of other
+        counts = np.diff(other.indptr)[self.indices]
+        total = counts.sum()
+        entry = np.repeat(np.arange(self.nnz), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        position = np.repeat(other.indptr[self.indices], counts) + np.arange(total) - first
+        return SparseMatrix.from_coo(
+                self.rows[entry],
+                other.indices[position],
+                self.data[entry]*other.data[position],
+                (self.shape[0], other.shape[1]),
+        )
+
+    def __matmul__(self, other):
+        if isinstance(other, SparseMatrix):
+            return self.matmul(other)
+        return self.dot(other)
+
+def loop_beta(valence):
+    # Loop's weight of every neighbor of an interior vertex
+    n = np.maximum(valence, 1)
+    return (5/8 - (3/8 + np.cos(2*math.pi/n)/4)**2) / n
+
+def loop_level(faces, n_verts):
+    """
+    One level of Loop subdivision, returns the (n_verts + E, n_verts) subdivision matrix and
+    the new faces. Edges without exactly two faces (open borders, non-manifold edges) are
+    treated as creases: vertices on two of them follow the crease curve and other crease
+    vertices (corners) stay in place.
+    """
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    n_faces = len(faces)
+    # half edge i of a face goes from corner i to corner i + 1, corner i + 2 is opposite
+    half_edges = np.stack((faces, np.roll(faces, -1, axis=1)), axis=2).reshape(-1, 2)
+    opposite = np.roll(faces, -2, axis=1).ravel()
+    edges, edge_of_half, counts = np.unique(np.sort(half_edges, axis=1), axis=0, return_inverse=True, return_counts=True)
+    edge_of_half = edge_of_half.ravel()
+    n_edges = len(edges)
+    interior = counts == 2
+    edge_rows = n_verts + np.arange(n_edges)
+
+    rows = []
+    cols = []
+    data = []
+    # edge points: 3/8 of the ends and 1/8 of both opposite vertices, the midpoint on creases
+    end_weight = np.where(interior, 3/8, 1/2)
+    for end in range(2):
+        rows.append(edge_rows)
+        cols.append(edges[:, end])
+        data.append(end_weight)
+    inner_half = interior[edge_of_half]
+    rows.append(n_verts + edge_of_half[inner_half])
+    cols.append(opposite[inner_half])
+    data.append(np.full(inner_half.sum(), 1/8))
+
+    # vertex points
+    valence = np.bincount(edges.ravel(), minlength=n_verts)
+    crease_edges = edges[~interior]
+    crease_valence = np.bincount(crease_edges.ravel(), minlength=n_verts)
+    on_curve = crease_valence == 2
+    fixed = (crease_valence > 0) & ~on_curve
+    beta = loop_beta(valence)
+    center = np.where(on_curve, 3/4, np.where(fixed, 1.0, 1 - valence*beta))
+    rows.append(np.arange(n_verts))
+    cols.append(np.arange(n_verts))
+    data.append(center)
+    # interior vertices take beta of every neighbor
+    inner = crease_valence == 0
+    for a, b in ((0, 1), (1, 0)):
+        use = inner[edges[:, a]]
+        rows.append(edges[use, a])
+        cols.append(edges[use, b])
+        data.append(beta[edges[use, a]])
+    # crease vertices take 1/8 of their two neighbors along the crease
+    for a, b in ((0, 1), (1, 0)):
+        use = on_curve[crease_edges[:, a]]
+        rows.append(crease_edges[use, a])
+        cols.append(crease_edges[use, b])
+        data.append(np.full(use.sum(), 1/8))
+
+    matrix = SparseMatrix.from_coo(np.concatenate(rows), np.concatenate(cols), np.concatenate(data), (n_verts + n_edges, n_verts))
+
+    # every face is split in four, the edge point of half edge i is n_verts + edge_of_half
+    mid = (n_verts + edge_of_half).reshape(n_faces, 3)
+    a, b, c = faces[:, 0], faces[:, 1], faces[:, 2]
+    ab, bc, ca = mid[:, 0], mid[:, 1], mid[:, 2]
+    new_faces = np.concatenate((
+        np.stack((a, ab, ca), axis=1),
+        np.stack((b, bc, ab), axis=1),
+        np.stack((c, ca, bc), axis=1),
+        np.stack((ab, bc, ca), axis=1),
+    ))
+    return matrix, new_faces
+
+class LoopSubdivision:
+
+    def __init__(self, verts, inds, levels=1):
+        self.base_vertices = np.array(verts, dtype=float).reshape(-1, 3)
+        inds = np.asarray(inds, dtype=np.int64).ravel()
+        self.base_faces = inds[:len(inds) - len(inds) % 3].reshape(-1, 3)
+        self.levels = levels
+
+        # compose the levels into one base -> finest matrix
+        faces = self.base_faces
+        n_verts = len(self.base_vertices)
+        matrix = None
+        for _ in range(levels):
+            level, faces = loop_level(faces, n_verts)
+            matrix = level if matrix is None else level @ matrix
+            n_verts = level.shape[0]
+        self.faces = faces
+        self.matrix = matrix
+        # columns of the matrix, the rows a base vertex influences
+        self.columns = matrix.transpose() if matrix is not None else None
+        self.vertices = self.evaluate()
+        self.subdivided = None
+
+    def evaluate(self):
+        if self.matrix is None:
+            return self.base_vertices.copy()
+        return self.matrix @ self.base_vertices
+
+    def set_base_vertices(self, verts):
+        self.base_vertices = np.array(verts, dtype=float).reshape(-1, 3)
+        self.vertices = self.evaluate()
+        if self.subdivided is not None:
+            self.subdivided.update(self.vertices)
+
+    def move_vertex(self, index, position):
+        """Move a base vertex and update only the subdivided vertices it influences."""
+        delta = np.asarray(position, dtype=float) - self.base_vertices[index]
+        self.base_vertices[index] += delta
+        if self.columns is None:
+            self.vertices[index] = self.base_vertices[index]
+        else:
+            start, end = self.columns.indptr[index], self.columns.indptr[index + 1]
+            self.vertices[self.columns.indices[start:end]] += self.columns.data[start:end, None]*delta
+        if self.subdivided is not None:
+            self.subdivided.update()
+
+    def mesh(self):
+        """The subdivided Mesh, the same object after every edit (with a new version)."""
+        if self.subdivided is None:
+            self.subdivided = Mesh(self.vertices, self.faces)
+        return self.subdivided
+
+def subdivide_mesh(verts, inds, levels=1):
+    """Loop subdivide the mesh levels times, returns the (N, 3) vertices and (M, 3) faces."""
+    subdivision = LoopSubdivision(verts, inds, levels)
+    return subdivision.vertices, subdivision.faces
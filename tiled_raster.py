@@ -0,0 +1,167 @@
+"""
+Tile-parallel rasterization with a process pool
+
+The screen is split into fixed size tiles and every screen space triangle is binned into
+the tiles its bounding box touches. Each tile is rasterized by a worker process with
+rasterizer.rasterize_tris, clipped to the tile, so no two workers ever write the same
+pixel. The color and depth buffers live in shared memory: the workers attach to them once
+when they start, only the triangles of a tile are sent to a worker, never pixels.
+"""
+import atexit
+import multiprocessing
+import os
+import signal
+from multiprocessing import shared_memory
+
+import numpy as np
+import pygame
+
+from rasterizer import rasterize_tris
+
+
+TILE_SIZE = 64
+
+# the shared buffers as seen by a worker process
+worker_buffers = None
+
+
+def attach_buffers(color_name, depth_name, size):
+    color_mem = shared_memory.SharedMemory(name=color_name)
+    depth_mem = shared_memory.SharedMemory(name=depth_name)
+    width, height = size
+    color = np.ndarray((width, height, 3), dtype=np.uint8, buffer=color_mem.buf)
+    depth = np.ndarray((width, height), dtype=np.float32, buffer=depth_mem.buf)
+    # keep the SharedMemory objects alive as long as the arrays
+    return (color_mem, depth_mem, color, depth)
+
+def init_worker(color_name, depth_name, size):
+    global worker_buffers
+    # forked from a process running pygame, the workers inherit SDL's signal handlers and
+    # would ignore the pool shutting them down
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    worker_buffers = attach_buffers(color_name, depth_name, size)
+
+def raster_tile(task):
+    (x0, y0, x1, y1), tris, depths, colors = task
+    _, _, color, depth = worker_buffers
+    tris = tris - (x0, y0)
+    rasterize_tris(color[x0:x1, y0:y1], depth[x0:x1, y0:y1], tris, depths, colors)
+    return len(tris)
+
+def bin_tris(tris, size, tile_size):
+    """
+    Returns (tile x, tile y, triangle) triples sorted by tile for every tile the
+    bounding box of a triangle overlaps.
+    """
+    width, height = size
+    n_x = (width + tile_size - 1) // tile_size
+    n_y = (height + tile_size - 1) // tile_size
+    lo = np.floor(tris.min(axis=1)).astype(np.int64) // tile_size
+    hi = np.ceil(tris.max(axis=1)).astype(np.int64) // tile_size
+    lo = np.maximum(lo, 0)
+    hi = np.minimum(hi, (n_x - 1, n_y - 1))
+    span = hi - lo + 1
+    on_screen = (span > 0).all(axis=1)
+    tri = np.flatnonzero(on_screen)
+    lo, span = lo[on_screen], span[on_screen]
+
+    count = span[:, 0]*span[:, 1]
+    entry = np.repeat(np.arange(len(tri)), count)
+    k = np.arange(len(entry)) - np.repeat(np.cumsum(count) - count, count)
+    tile_x = lo[entry, 0] + k % span[entry, 0]
+    tile_y = lo[entry, 1] + k // span[entry, 0]
+    tile_id = tile_y*n_x + tile_x
+    # stable, so every tile keeps the submission order of its triangles
+    order = np.argsort(tile_id, kind="stable")
+    return tile_x[order], tile_y[order], tri[entry[order]]
+
+class TiledRasterizer:
+
+    def __init__(self, workers=None, tile_size=TILE_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.tile_size = tile_size
+        self.size = None
+        self.pool = None
+        self.color_mem = None
+        self.depth_mem = None
+        self.color = None
+        self.depth = None
+        atexit.register(self.close)
+
+    def resize(self, size):
+        self.close()
+        width, height = size
+        self.size = (width, height)
+        self.color_mem = shared_memory.SharedMemory(create=True, size=max(width*height*3, 1))
+        self.depth_mem = shared_memory.SharedMemory(create=True, size=max(width*height*4, 1))
+        self.color = np.ndarray((width, height, 3), dtype=np.uint8, buffer=self.color_mem.buf)
+        self.depth = np.ndarray((width, height), dtype=np.float32, buffer=self.depth_mem.buf)
+        self.depth.fill(np.inf)
+        self.pool = multiprocessing.Pool(
+                self.workers,
+                initializer=init_worker,
+                initargs=(self.color_mem.name, self.depth_mem.name, self.size),
+        )
+
+    def clear(self, size):
+        if self.size != tuple(size):
+            self.resize(size)
+        self.depth.fill(np.inf)
+
+    def close(self):
+        if self.pool is not None:
+            # every draw waits for its tiles, so there is no work left to cancel
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        # the views have to go before the shared memory can be closed
+        self.color = None
+        self.depth = None
+        for mem in (self.color_mem, self.depth_mem):
+            if mem is not None:
+                mem.close()
+                mem.unlink()
+        self.color_mem = None
+        self.depth_mem = None
+        self.size = None
+
+    def draw(self, surface, tris, depths, colors):
+        """Same arguments as rasterizer.draw_tris_zbuffered, minus the depth buffer."""
+        if self.size != surface.get_size():
+            self.clear(surface.get_size())
+        tris = np.asarray(tris, dtype=np.float64)
+        depths = np.asarray(depths, dtype=np.float64)
+        colors = np.asarray(colors, dtype=np.float64)
+        if not len(tris):
+            return
+
+        tile_x, tile_y, tri = bin_tris(tris, self.size, self.tile_size)
+        if not len(tri):
+            return
+        starts = np.flatnonzero(np.r_[True, (tile_x[1:] != tile_x[:-1]) | (tile_y[1:] != tile_y[:-1])])
+        ends = np.r_[starts[1:], len(tri)]
+        width, height = self.size
+        tasks = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            x0 = int(tile_x[start])*self.tile_size
+            y0 = int(tile_y[start])*self.tile_size
+            rect = (x0, y0, min(x0 + self.tile_size, width), min(y0 + self.tile_size, height))
+            sel = tri[start:end]
+            tasks.append((rect, tris[sel], depths[sel], colors[sel]))
+        # the busiest tiles first so they don't end up as the tail of the frame
+        tasks.sort(key=lambda task: -len(task[1]))
+
+        chunksize = max(len(tasks) // (4*self.workers), 1)
+        try:
+            pixels = pygame.surfarray.pixels3d(surface)
+        except ValueError:
+            # pixel format without a direct view
+            self.color[...] = pygame.surfarray.array3d(surface)
+            self.pool.map(raster_tile, tasks, chunksize=chunksize)
+            pygame.surfarray.blit_array(surface, self.color)
+            return
+        self.color[...] = pixels
+        self.pool.map(raster_tile, tasks, chunksize=chunksize)
+        pixels[...] = self.color
+        del pixels
@@ -0,0 +1,120 @@
+"""
+Recording and replaying orbiter runs
+
+TrajectoryRecorder streams the positions of every recorded step into an append-only binary
+file: a fixed header (number of orbiters, attractor slots, time between frames) followed by
+frames of float32 (x, y) points, the orbiters first and then the attractor slots (NaN when a
+slot is unused). Nothing is ever rewritten, the number of frames follows from the file size so
+a run that was cut off still replays up to its last whole frame.
+
+TrajectoryReplay memory-maps the frames, seeking to any time is an index into the map and only
+the pages of the frames that are drawn are read from disk.
+"""
+import math
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = b"ORBITRACE"
+VERSION = 1
+
+# magic, version, number of orbiters, attractor slots, seconds between frames
+HEADER = struct.Struct("<9sIqqd")
+# keep the frames aligned for the memory map
+HEADER_SIZE = 64
+
+
+class TrajectoryRecorder:
+
+    def __init__(self, filename, n_orbiters, frame_time, max_attractors=8, every=1):
+        self.filename = filename
+        self.n_orbiters = n_orbiters
+        self.max_attractors = max_attractors
+        # only every n-th step of a simulation is recorded
+        self.every = every
+        self.frames = 0
+        self.buffer = np.empty((n_orbiters + max_attractors, 2), dtype="<f4")
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, n_orbiters, max_attractors, frame_time*every).ljust(HEADER_SIZE, b"\0"))
+        # a replay can open the file as soon as it exists
+        self.file.flush()
+
+    def record(self, positions, attractors=()):
+        """Append one frame, attractors past the last slot are not recorded."""
+        attractors = np.asarray(attractors, dtype=float).reshape(-1, 2)[:self.max_attractors]
+        self.buffer[:self.n_orbiters] = positions
+        self.buffer[self.n_orbiters:] = np.nan
+        self.buffer[self.n_orbiters:self.n_orbiters + len(attractors)] = attractors
+        self.file.write(self.buffer.tobytes())
+        self.frames += 1
+
+    def __call__(self, simulation):
+        # as an observer of simulation.Simulation, called after every step
+        if simulation.steps % self.every == 0:
+            self.record(simulation.positions, simulation.attractors)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class TrajectoryReplay:
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            data = file.read(HEADER.size)
+        if len(data) != HEADER.size:
+            raise ValueError(f"{filename} is not a trajectory file")
+        magic, version, self.n_orbiters, self.max_attractors, self.frame_time = HEADER.unpack(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename} is not a trajectory file (or a different version)")
+        self.frame_points = self.n_orbiters + self.max_attractors
+        self.frame_bytes = self.frame_points*2*4
+        self.frames = None
+        self.refresh()
+
+    def refresh(self):
+        """Map the frames again, picks up the frames a recorder appended since."""
+        n_frames = (os.path.getsize(self.filename) - HEADER_SIZE) // self.frame_bytes
+        if self.frames is not None and len(self.frames) == n_frames:
+            return
+        if n_frames > 0:
+            self.frames = np.memmap(self.filename, dtype="<f4", mode="r", offset=HEADER_SIZE, shape=(n_frames, self.frame_points, 2))
+        else:
+            self.frames = np.empty((0, self.frame_points, 2), dtype="<f4")
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        return max(len(self) - 1, 0) * self.frame_time
+
+    def frame(self, index):
+        """The (N, 2) orbiter positions and (K, 2) attractors of a frame."""
+        frame = self.frames[index]
+        attractors = frame[self.n_orbiters:]
+        return frame[:self.n_orbiters], attractors[~np.isnan(attractors[:, 0])]
+
+    def at(self, time):
+        """The positions and attractors at time (seconds, clamped to the run), interpolated between frames."""
+        if not len(self):
+            raise IndexError("the trajectory has no frames")
+        t = min(max(time / self.frame_time, 0.0), len(self) - 1.0)
+        index = min(int(math.floor(t)), len(self) - 1)
+        alpha = t - index
+        positions, attractors = self.frame(index)
+        positions = np.asarray(positions, dtype=float)
+        if alpha > 0:
+            positions += alpha*(self.frames[index + 1, :self.n_orbiters] - positions)
+        return positions, np.asarray(attractors, dtype=float)
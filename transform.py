@@ -0,0 +1,168 @@
+"""
+4x4 model/view/projection transform with cached composite matrices
+
+Each matrix is rebuilt only when one of its inputs actually changed (dirty flags), so a
+frame where no slider moved does no matrix work at all.
+"""
+import math
+
+import numpy as np
+
+
+def rotation_matrix(angle):
+    # the viewer's rotation: around y, then around x
+    c, s = math.cos(angle), math.sin(angle)
+    rot_1 = np.array([
+        [c, 0, s],
+        [0, 1, 0],
+        [-s, 0, c],
+    ])
+    rot_2 = np.array([
+        [1, 0, 0],
+        [0, c, s],
+        [0, -s, c],
+    ])
+    mat = np.identity(4)
+    mat[:3, :3] = rot_1 @ rot_2
+    return mat
+
+def scale_matrix(scale):
+    return np.diag([scale[0], scale[1], scale[2], 1.0])
+
+def translation_matrix(offset):
+    mat = np.identity(4)
+    mat[:3, 3] = offset[:3]
+    return mat
+
+def view_matrix(cam):
+    # the camera looks down -z from its position
+    return translation_matrix(-np.asarray(cam.position, dtype=float))
+
+def projection_matrix(cam):
+    # clip w is the distance in front of the camera, x/w and y/w match Camera.project_point
+    flen = cam.aspect_ratio/(2*math.tan(cam.fov))
+    near, far = cam.near, cam.far
+    return np.array([
+        [flen/cam.aspect_ratio, 0, 0, 0],
+        [0, flen, 0, 0],
+        [0, 0, -(far + near)/(far - near), -2*far*near/(far - near)],
+        [0, 0, -1, 0],
+    ])
+
+def camera_key(cam):
+    return (cam.fov, cam.aspect_ratio, cam.near, cam.far, tuple(np.asarray(cam.position, dtype=float).tolist()))
+
+def normal_matrix(mat):
+    # cofactor matrix of the upper 3x3, normals transform with it: cof(M)(a x b) = (Ma) x (Mb)
+    # (unlike the inverse transpose it also exists when a scale is zero)
+    r0, r1, r2 = mat[:3, :3]
+    return np.array([np.cross(r1, r2), np.cross(r2, r0), np.cross(r0, r1)])
+
+def transform_points(mat, points):
+    # apply a 4x4 affine matrix to a (..., 3) array
+    # (one 2d matmul, a stacked (M, 3, 3) @ (3, 3) matmul is several times slower)
+    out = points.reshape(-1, 3) @ mat[:3, :3].T
+    if mat[:3, 3].any():
+        out += mat[:3, 3]
+    return out.reshape(points.shape)
+
+def normal_matrices(mats):
+    # normal_matrix for a (K, 4, 4) stack of matrices
+    r0, r1, r2 = mats[:, 0, :3], mats[:, 1, :3], mats[:, 2, :3]
+    return np.stack((np.cross(r1, r2), np.cross(r2, r0), np.cross(r0, r1)), axis=1)
+
+def transform_points_batch(mats, points):
+    # apply every matrix of a (K, 4, 4) (or (K, 3, 3)) stack to the same (N, 3) points, returns (K, N, 3)
+    # (the K matrices side by side make it a single (N, 3) @ (3, 3K) matmul)
+    k = len(mats)
+    rot = mats[:, :3, :3].transpose(2, 0, 1).reshape(3, 3*k)
+    out = (points @ rot).reshape(len(points), k, 3).transpose(1, 0, 2)
+    if mats.shape[1] == 4:
+        return out + mats[:, None, :3, 3]
+    return np.ascontiguousarray(out)
+
+class Transform:
+
+    def __init__(self, scale=(1, 1, 1), angle=0, position=(0, 0, 0)):
+        self.scale = tuple(scale)
+        self.angle = angle
+        self.position = tuple(position)
+        self.camera = None
+        # bumped every time the model matrix is rebuilt, lets users cache things derived from it
+        self.version = 0
+
+        self.scale_mat = None
+        self.model_mat = None
+        self.view_mat = None
+        self.projection_mat = None
+        self.view_projection_mat = None
+        self.model_dirty = True
+        self.camera_dirty = True
+
+    def set_scale(self, scale):
+        scale = tuple(scale)
+        if scale != self.scale:
+            self.scale = scale
+            self.model_dirty = True
+
+    def set_angle(self, angle):
+        if angle != self.angle:
+            self.angle = angle
+            self.model_dirty = True
+
+    def set_position(self, position):
+        position = tuple(position)
+        if position != self.position:
+            self.position = position
+            self.model_dirty = True
+
+    def set_camera(self, cam):
+        key = camera_key(cam)
+        if key != self.camera:
+            self.camera = key
+            self.camera_dirty = True
+
+    def update(self):
+        if self.model_dirty:
+            self.scale_mat = scale_matrix(self.scale)
+            self.model_mat = rotation_matrix(self.angle) @ self.scale_mat
+            if any(self.position):
+                self.model_mat = translation_matrix(self.position) @ self.model_mat
+            self.model_dirty = False
+            self.version += 1
+
+    def get_scale_matrix(self):
+        self.update()
+        return self.scale_mat
+
+    def get_model_matrix(self):
+        self.update()
+        return self.model_mat
+
+    def get_view_projection_matrix(self, cam):
+        self.set_camera(cam)
+        if self.camera_dirty:
+            self.view_mat = view_matrix(cam)
+            self.projection_mat = projection_matrix(cam)
+            self.view_projection_mat = self.projection_mat @ self.view_mat
+            self.camera_dirty = False
+        return self.view_projection_mat
+
+    def get_mvp_matrix(self, cam):
+        return self.get_view_projection_matrix(cam) @ self.get_model_matrix()
+
+    def project(self, cam, world):
+        """
+        Project (..., 3) world space points, returns the (..., 2) normalized device
+        coordinates and a mask of the points in front of the near plane.
+        """
+        vp = self.get_view_projection_matrix(cam)
+        # only x, y and w are needed
+        rows = vp[[0, 1, 3]]
+        clip = world.reshape(-1, 3) @ rows[:, :3].T
+        clip += rows[:, 3]
+        clip = clip.reshape(world.shape)
+        w = clip[..., 2]
+        visible = w >= cam.near
+        w = np.where(visible, w, 1.0)
+        return clip[..., :2] / w[..., None], visible